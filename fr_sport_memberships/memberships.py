@@ -0,0 +1,210 @@
+"""Loader of the French sport memberships datasets.
+clubs-data-{year}.csv and lic-data-{year}.csv (";" separated) are parsed once
+with compact dtypes (categories for text columns, downcast numbers) and
+cached column by column in a .npz file, along with the checksum of the CSV:
+an edited CSV is parsed again. Club and licence totals are aggregated once
+into a year x Fédération x Département cube, so the usual rankings are index
+lookups instead of group-bys over the whole datasets. Both datasets are joined
+on normalized Département codes (see department_code).
+
+    cube = load_cube()
+    cube.top_federations(2021)
+    cube.department_ranking("14", 2021, "clubs")
+"""
+import glob
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = ".cache"
+# Codes are text ("01", "2A", "NR", "ETR"...), not numbers
+CODE_COLUMNS = ["Code Commune", "Code QPV", "Département", "Code"]
+CUBE_KEYS = ["year", "Fédération", "Département"]
+MEASURES = ["clubs", "club_rows", "licences"]
+# Part of the cube cache checksum: bump it when the measures change
+CUBE_VERSION = 3
+
+
+def file_checksum(filename, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        while block := file.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_csv(filename):
+    """Dataset with text columns as categories and downcast numeric columns"""
+    df = pd.read_csv(filename, sep=";", dtype={column: str for column in CODE_COLUMNS})
+    for column in df.columns:
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="float")
+        else:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def save_columns(cache_file, df, checksum):
+    """Writes the columns of df (categories as codes and categories) to a .npz file"""
+    arrays = {"checksum": np.array(checksum), "columns": np.array(df.columns, dtype=str)}
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[f"codes_{i}"] = values.cat.codes.to_numpy()
+            arrays[f"categories_{i}"] = values.cat.categories.to_numpy(dtype=str)
+        else:
+            arrays[f"values_{i}"] = values.to_numpy()
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    with open(cache_file + ".tmp", "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(cache_file + ".tmp", cache_file)
+
+
+def load_columns(cache_file):
+    """Checksum and DataFrame of a file written by save_columns"""
+    with np.load(cache_file) as data:
+        columns = {}
+        for i, column in enumerate(data["columns"].tolist()):
+            if f"codes_{i}" in data:
+                columns[column] = pd.Categorical.from_codes(
+                    data[f"codes_{i}"], data[f"categories_{i}"]
+                )
+            else:
+                columns[column] = data[f"values_{i}"]
+        return str(data["checksum"]), pd.DataFrame(columns)
+
+
+def load_dataset(filename, cache_dir=None):
+    """Parsed CSV file, from its cache when the CSV did not change"""
+    cache_dir = cache_dir or os.path.join(os.path.dirname(filename), CACHE_DIR)
+    cache_file = os.path.join(cache_dir, os.path.basename(filename) + ".npz")
+    checksum = file_checksum(filename)
+    if os.path.exists(cache_file):
+        cached_checksum, df = load_columns(cache_file)
+        if cached_checksum == checksum:
+            return df
+    df = parse_csv(filename)
+    save_columns(cache_file, df, checksum)
+    return df
+
+
+def dataset_files(prefix, data_dir="."):
+    """{year: file} of the {prefix}-data-{year}.csv files of data_dir"""
+    files = {}
+    for filename in glob.glob(os.path.join(data_dir, f"{prefix}-data-*.csv")):
+        match = re.search(r"-data-(\d{4})\.csv$", filename)
+        if match:
+            files[int(match.group(1))] = filename
+    return dict(sorted(files.items()))
+
+
+def load_clubs(year=2021, data_dir=".", cache_dir=None):
+    return load_dataset(os.path.join(data_dir, f"clubs-data-{year}.csv"), cache_dir)
+
+
+def load_licences(year=2021, data_dir=".", cache_dir=None):
+    return load_dataset(os.path.join(data_dir, f"lic-data-{year}.csv"), cache_dir)
+
+
+def department_code(code):
+    """Département code as in the clubs datasets: numeric codes zero-padded to
+    two digits ("1" -> "01", "974" unchanged), letters upper case.
+    Corsica stays split in "2A" and "2B": a file coding it as a single "20"
+    keeps that code, which does not match the "2A" and "2B" rows."""
+    code = str(code).strip().upper()
+    return code.zfill(2) if code.isdigit() else code
+
+
+def normalize_departments(df):
+    """df with the department_code of its Département column, as a category"""
+    departments = df["Département"].astype("category")
+    categories = departments.cat.categories
+    codes = pd.Categorical(categories.map(department_code))[departments.cat.codes]
+    # Missing codes (-1) stay missing
+    codes[departments.cat.codes.to_numpy() < 0] = np.nan
+    return df.assign(Département=codes)
+
+
+def year_totals(clubs_df=None, licences_df=None):
+    """Totals of one year by (Fédération, Département): clubs, rows of the clubs
+    dataset with a commune (counted as in exploration.ipynb) and licences.
+    Both datasets are joined on their department_code."""
+    totals = []
+    if clubs_df is not None:
+        clubs_df = normalize_departments(clubs_df)
+        totals.append(clubs_df.groupby(["Fédération", "Département"], observed=True).agg(
+            clubs=("Clubs", "sum"), club_rows=("Commune", "count")
+        ))
+    if licences_df is not None:
+        licences_df = normalize_departments(licences_df)
+        totals.append(licences_df.groupby(["Fédération", "Département"], observed=True).agg(
+            licences=("Total", "sum")
+        ))
+    totals = pd.concat(totals, axis=1).reindex(columns=MEASURES)
+    return totals.fillna(0).astype(np.int32)
+
+
+class MembershipCube:
+    """Club and licence totals (MEASURES) indexed by year, Fédération and
+    Département, with the totals of each federation"""
+
+    def __init__(self, cube):
+        self.cube = cube.sort_index()
+        self.federations = self.cube.groupby(level=["year", "Fédération"], observed=True).sum()
+
+    @property
+    def years(self):
+        return self.cube.index.get_level_values("year").unique().tolist()
+
+    def top_federations(self, year, measure="licences", n=50):
+        return self.federations.loc[year, measure].nlargest(n)
+
+    def department_ranking(self, department, year, measure="licences", n=50):
+        """Federations of a department (any code, see department_code), by decreasing measure"""
+        totals = self.cube.xs((year, department_code(department)), level=("year", "Département"))
+        return totals[measure].nlargest(n)
+
+    def federation_ranking(self, federation, year, measure="licences", n=None):
+        """Departments of a federation, by decreasing measure"""
+        return self.cube.loc[(year, federation), measure].sort_values(ascending=False)[:n]
+
+
+def build_cube(data_dir=".", cache_dir=None):
+    """DataFrame of year_totals of every year with a clubs or licences file"""
+    clubs_files = dataset_files("clubs", data_dir)
+    licences_files = dataset_files("lic", data_dir)
+    totals = {}
+    for year in sorted(clubs_files.keys() | licences_files.keys()):
+        totals[year] = year_totals(
+            load_dataset(clubs_files[year], cache_dir) if year in clubs_files else None,
+            load_dataset(licences_files[year], cache_dir) if year in licences_files else None,
+        )
+    if not totals:
+        raise FileNotFoundError(f"No clubs-data-*.csv or lic-data-*.csv file in {data_dir}")
+    cube = pd.concat(totals, names=["year"]).reset_index()
+    cube["year"] = cube["year"].astype(np.int16)
+    return cube.astype({"Fédération": "category", "Département": "category"})
+
+
+def load_cube(data_dir=".", cache_dir=None):
+    """MembershipCube of the datasets of data_dir, cached until one of them changes"""
+    cache_dir = cache_dir or os.path.join(data_dir, CACHE_DIR)
+    cache_file = os.path.join(cache_dir, "cube.npz")
+    files = [*dataset_files("clubs", data_dir).values(), *dataset_files("lic", data_dir).values()]
+    checksum = hashlib.sha256(" ".join(
+        [f"v{CUBE_VERSION}", *(f"{os.path.basename(f)}:{file_checksum(f)}" for f in files)]
+    ).encode()).hexdigest()
+    cube = None
+    if os.path.exists(cache_file):
+        cached_checksum, cube = load_columns(cache_file)
+        if cached_checksum != checksum:
+            cube = None
+    if cube is None:
+        cube = build_cube(data_dir, cache_dir)
+        save_columns(cache_file, cube, checksum)
+    return MembershipCube(cube.set_index(CUBE_KEYS))
@@ -0,0 +1,214 @@
+"""Local advisor service.
+A long-running asyncio server keeping agents, their tables and warm caches
+in memory, and answering "best lock / best row for this sheet and throw"
+requests from any number of table sessions. Requests and responses are JSON
+lines over a Unix socket (or localhost TCP):
+
+    {"id": 1, "op": "open", "session": "table 1", "agent": "YamsT2KE"}
+    {"id": 2, "op": "lock", "session": "table 1", "sheet": {"1": 3, ...},
+     "throw": [1, 1, 3, 5, 6], "first_lock": true}
+    {"id": 3, "op": "row", "session": "table 1", "state": 0, "throw": [2, 2, 2, 4, 4]}
+    {"id": 4, "op": "stats"}
+
+Sheets are sheet dicts (missing or null rows are open) or compact states.
+Every response repeats the request id and gives its latency in ms; "stats"
+returns the latency distribution of every agent and operation.
+
+    python advisor.py --agents YamsT1E YamsT2KE   # serves on DEFAULT_SOCKET
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+from agents import YamsOptimal, YamsT1, YamsT1E, YamsT1T, YamsT2, YamsT2KE
+from caches import cache_stats
+from profiling import record, summarize
+from yams import (
+    BALANCE_SHIFT,
+    BONUS_THRESHOLD,
+    EMPTY_STATE,
+    ROWS_MASK,
+    SHEET_KEYS,
+    THROWS,
+    as_state,
+    state_points,
+    throw_index,
+)
+
+DEFAULT_SOCKET = "/tmp/yams_advisor.sock"
+AGENT_CLASSES = {
+    agent_class.__name__: agent_class
+    for agent_class in (YamsT1, YamsT1E, YamsT1T, YamsT2, YamsT2KE, YamsOptimal)
+}
+
+
+def parse_sheet(request):
+    """Compact state of the request's "state" or "sheet" (keys as in SHEET_KEYS or str),
+    which must have an open row"""
+    if "state" in request:
+        state = int(request["state"])
+        if not 0 <= state >> BALANCE_SHIFT <= BONUS_THRESHOLD:
+            raise ValueError(f"{state} is not a compact state")
+    else:
+        sheet = request["sheet"]
+        state = as_state({k: sheet.get(str(k), sheet.get(k)) for k in SHEET_KEYS})
+    if state & ROWS_MASK == ROWS_MASK:
+        raise ValueError("The sheet is full")
+    return state
+
+
+def parse_throw(request):
+    throw = tuple(sorted(int(die) for die in request["throw"]))
+    if len(throw) != 5 or not set(throw) <= set(range(1, 7)):
+        raise ValueError(f"{request['throw']} is not a throw of 5 dice")
+    return throw
+
+
+def warm_up(agent):
+    """Decides every throw of the first turn, filling the agent's tables and caches"""
+    states, throws = np.full(len(THROWS), EMPTY_STATE), np.arange(len(THROWS))
+    agent.lock_dice_many(states, throws, is_first_lock=True)
+    agent.lock_dice_many(states, throws, is_first_lock=False)
+    agent.choose_row_many(states, throws)
+
+
+class Advisor:
+    """Agents (by name, str(agent)) and table sessions of the advisor service.
+    Decisions run one at a time in a worker thread, so agents and caches are
+    never used concurrently while the event loop keeps serving connections.
+    """
+
+    def __init__(self, agents, warm=True):
+        self.agents = {str(agent): agent for agent in agents}
+        self.default_agent = next(iter(self.agents))
+        self.sessions = {}  # Session name: agent name
+        self.timers = {}  # Latencies, as profiling timers
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        if warm:
+            for agent in self.agents.values():
+                warm_up(agent)
+
+    def get_agent(self, request):
+        name = request.get("agent") or self.sessions.get(request.get("session"))
+        name = name or self.default_agent
+        if name not in self.agents:
+            raise ValueError(f"Unknown agent {name}, serving {list(self.agents)}")
+        return self.agents[name]
+
+    def lock(self, request):
+        agent = self.get_agent(request)
+        lock_choice = agent.lock_dice(
+            parse_sheet(request), parse_throw(request), request.get("first_lock", True)
+        )
+        return str(agent), {"lock": list(lock_choice)}
+
+    def row(self, request):
+        agent = self.get_agent(request)
+        state, throw = parse_sheet(request), parse_throw(request)
+        row = agent.choose_row(state, throw)
+        points = state_points(state, throw_index(throw), real=True)[SHEET_KEYS.index(row)]
+        return str(agent), {"row": row, "points": int(points)}
+
+    def open_session(self, request):
+        session = request["session"]
+        self.sessions[session] = str(self.get_agent(request))
+        return self.sessions[session], {"session": session}
+
+    def close_session(self, request):
+        return self.sessions.pop(request["session"], None), {"session": request["session"]}
+
+    def stats(self, request):
+        report = summarize({"pids": [os.getpid()], "timers": self.timers, "caches": cache_stats()})
+        return None, {**report, "sessions": len(self.sessions)}
+
+    async def answer(self, request):
+        """Response to a request (dict), with its latency"""
+        t0 = perf_counter()
+        operations = {
+            "lock": self.lock,
+            "row": self.row,
+            "open": self.open_session,
+            "close": self.close_session,
+            "stats": self.stats,
+        }
+        op = request.get("op")
+        try:
+            if op not in operations:
+                raise ValueError(f"Unknown op {op}, expected one of {list(operations)}")
+            loop = asyncio.get_running_loop()
+            agent_name, response = await loop.run_in_executor(
+                self.executor, operations[op], request
+            )
+        except Exception as error:  # Answered as an error, the connection stays open
+            agent_name, response = None, {"error": f"{error.__class__.__name__}: {error}"}
+        latency = perf_counter() - t0
+        if agent_name is not None and "error" not in response:
+            record(f"{agent_name}.{op}", latency, self.timers)
+        return {"id": request.get("id"), **response, "latency_ms": 1e3 * latency}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Requests are JSON objects")
+                except ValueError as error:
+                    response = {"id": None, "error": f"Invalid request: {error}"}
+                else:
+                    response = await self.answer(request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=DEFAULT_SOCKET, port=None):
+        """Serves forever on the Unix socket, or on localhost:port if given"""
+        if port is not None:
+            server = await asyncio.start_server(self.handle_connection, "127.0.0.1", port)
+        else:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle_connection, socket_path)
+        async with server:
+            await server.serve_forever()
+
+
+def ask(requests, address=DEFAULT_SOCKET):
+    """Responses of the advisor to a list of requests (blocking client).
+    `address` is a Unix socket path or a (host, port) tuple."""
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.connect(address)
+        with connection.makefile("rwb") as stream:
+            for request in requests:
+                stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            return [json.loads(stream.readline()) for _ in requests]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--agents", nargs="+", default=["YamsT1E", "YamsT2KE"],
+                        choices=list(AGENT_CLASSES))
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--port", type=int, help="serve on localhost TCP instead")
+    args = parser.parse_args()
+
+    advisor = Advisor([AGENT_CLASSES[name]() for name in args.agents])
+    print(f"Serving {list(advisor.agents)} on {args.port or args.socket}")
+    try:
+        asyncio.run(advisor.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,55 @@ from typing import List, Tuple, Union
 
 import numpy as np
 from yams import (
+    BALANCE_SHIFT,
+    OPEN_ROWS_TABLE,
+    ROWS_MASK,
     SHEET_KEYS,
     SHEET_POSSIBLE_VALUES,
-    get_sheet_points,
-    print_pretty_sheet
+    THROWS,
+    as_state,
+    default_rng,
+    is_row_open,
+    print_pretty_sheet,
+    scoring_state,
+    scoring_states,
+    state_points,
+    states_points,
+    throw_index,
 )
+from caches import shared_cache
+from dice_tables import (
+    KEEP_INDEX,
+    THROW_KEEPS,
+    THROW_N_KEEPS,
+    aggregate_keeps,
+    keep_transitions,
+    throw_locks,
+)
+from book import OpeningBook, book_config
+from profiling import instrumented
+from search import TurnSearch
+from tree_export import export_tree
+from solver import ROW_COLUMNS, TurnPolicy, load_values, playable_mask
+
+# Rows scratched, in this order, when the chosen row is already filled
+ELIMINATION_ORDER = [
+    "Yams",
+    1,
+    "Grande Suite",
+    "Petite Suite",
+    "Full",
+    2,
+    "Carré",
+    "Brelan",
+    3,
+    4,
+    5,
+    6,
+    "Chance",
+]
+ELIMINATION_COLUMNS = np.array([SHEET_KEYS.index(k) for k in ELIMINATION_ORDER])
+
 
 def best_evaluation(throw_evaluation):
     max_score = max(throw_evaluation.values())
@@ -22,8 +66,12 @@ def best_evaluation(throw_evaluation):
     return best_options[0]
 
 
+@instrumented
 def generate_all_throws(dice_kept, max_dice=5):
     """Generate all throws that can be derived from an original set of dice"""
+    if max_dice == 5:
+        outcomes, _ = keep_transitions(dice_kept)
+        return [THROWS[i] for i in outcomes]
     n_dice = len(dice_kept)
     n_next_dice = max_dice - n_dice
     next_possibilities = product(*[range(1, 7) for _ in range(n_next_dice)])
@@ -33,7 +81,25 @@ def generate_all_throws(dice_kept, max_dice=5):
     return list(all_possibilities)
 
 
+def search_lock_scores(throw, keep_values):
+    """Lock scores dict (as aggregate_locks) from TurnSearch.lock_values"""
+    return dict(zip(throw_locks(throw_index(throw)), keep_values.tolist()))
+
+
+def best_locks(keep_values, inverse, throws):
+    """Best keep (KEEPS index) of each decision, ties broken in THROW_KEEPS order.
+    keep_values has a row of keep values per distinct state, inverse gives
+    the row of each decision."""
+    lock_choices = THROW_KEEPS[throws]
+    lock_values = keep_values[inverse[:, None], lock_choices]
+    return lock_choices[np.arange(len(throws)), np.argmax(lock_values, axis=1)]
+
+
+@instrumented
 def powerset(s):
+    """Distinct kept dice tuples of a throw (see dice_tables.THROW_LOCKS)"""
+    if len(s) == 5:
+        return list(throw_locks(throw_index(s)))
     res = []
     x = len(s)
     for i in range(1 << x):
@@ -43,11 +109,27 @@ def powerset(s):
     return ddupl_res
 
 
+def unique_decisions(states, throws):
+    """Distinct (state, throw) pairs of a batch, as (states, throws) arrays,
+    and the index of each decision's pair"""
+    states = np.asarray(states, dtype=np.int64)
+    throws = np.asarray(throws, dtype=np.int64)
+    pairs, inverse = np.unique(states * len(THROWS) + throws, return_inverse=True)
+    return (pairs // len(THROWS), pairs % len(THROWS)), inverse.ravel()
+
+
 class YamsAgent:
     """Agents to play Yams.
     Agents should never modify game's state, in particular player sheets.
+    Sheets can be given as dicts or as compact states (see yams.encode_sheet),
+    throws as sorted tuples or as their index in yams.THROWS.
     """
 
+    # Decisions are a function of the sheet state and throw (see exact_evaluation.py)
+    is_deterministic = True
+    # Lock decisions take the game's generator as `rng` (see yams.play_round)
+    uses_game_rng = False
+
     def __init__(self):
         pass
 
@@ -57,6 +139,67 @@ class YamsAgent:
     def choose_row(self, sheet, throw):
         raise NotImplementedError
 
+    def lock_dice_many(self, states, throws, is_first_lock=True):
+        """Batched lock_dice: kept dice (KEEPS indices) for arrays of
+        compact states and throw indices.
+        This default decides each distinct (state, throw) pair once with
+        lock_dice; subclasses vectorize it."""
+        (states, throws), inverse = unique_decisions(states, throws)
+        keeps = np.array([
+            KEEP_INDEX[tuple(sorted(self.lock_dice(state, throw, is_first_lock)))]
+            for (state, throw) in zip(states.tolist(), throws.tolist())
+        ], dtype=np.int64)
+        return keeps[inverse]
+
+    def choose_row_many(self, states, throws):
+        """Batched choose_row: chosen rows (SHEET_KEYS indices) for arrays of
+        compact states and throw indices"""
+        (states, throws), inverse = unique_decisions(states, throws)
+        rows = np.array([
+            SHEET_KEYS.index(self.choose_row(state, throw))
+            for (state, throw) in zip(states.tolist(), throws.tolist())
+        ], dtype=np.int64)
+        return rows[inverse]
+
+    def get_config(self):
+        """Constructor arguments of the agent"""
+        return {}
+
+    def cache_config(self):
+        """Parameters the cached values depend on (by default book_config)"""
+        return book_config(self)
+
+    def get_cache(self, name, maxsize=None, persist=True):
+        """Cache shared by the agents of this process with the same class and cache_config
+        (in memory only if not persist, see caches.shared_cache)"""
+        config = json.dumps(self.cache_config(), sort_keys=True, default=str)
+        return shared_cache(
+            f"{self.__class__.__name__}{config}:{name}", maxsize, persist=persist
+        )
+
+    # Opening book of precomputed turn policies (see book.py), if loaded
+    book = None
+
+    def load_book(self, book_file):
+        book = OpeningBook.load(book_file)
+        if not book.is_for(self):
+            raise ValueError(
+                f"{book_file} was built by {book.agent_name} {book.config}, not by this agent"
+            )
+        self.book = book
+
+    def book_lock(self, sheet, throw, is_first_lock=True):
+        """Lock decision from the book, None if the sheet state is not in it"""
+        if self.book is None:
+            return None
+        return self.book.lock(as_state(sheet), throw_index(throw), is_first_lock)
+
+    def book_row(self, sheet, throw):
+        """Row decision from the book, None if the sheet state is not in it"""
+        if self.book is None:
+            return None
+        return self.book.row(as_state(sheet), throw_index(throw))
+
     def __str__(self):
         return self.__class__.__name__
 
@@ -65,31 +208,97 @@ class YamsT1(YamsAgent):
     """Agent looking at throws at "depth 1" (thus T1).
     To lock dice, we look at
     1. All possible lock choices
-    2. All possible random throws (each one is equipossible)
+    2. All possible random throws, with their exact probability
     3. Scoring each random throw post-lock
-    4. Aggregating for each lock choice the scores with median
-    5. Choosing the lock choice with best median score
+    4. Aggregating for each lock choice the scores with their expectation
+    5. Choosing the lock choice with best expected score
     """
 
+    def __init__(self, lock_aggregate="mean", book_file=None):
+        # "mean", "median" or quantile of the throw scores reachable from a lock
+        self.lock_aggregate = lock_aggregate
+        self.book_file = book_file
+        # Throw tables are ~2.3kB each
+        self.throw_cache = self.get_cache("throws", maxsize=1 << 14)
+        if book_file is not None:
+            self.load_book(book_file)
+
+    def get_config(self):
+        return {"lock_aggregate": self.lock_aggregate, "book_file": self.book_file}
+
+    @property
+    def score_cache_hit(self):
+        return self.throw_cache.hits
+
+    @property
+    def score_cache_missed(self):
+        return self.throw_cache.misses
+
+    def row_scores(self, points):
+        """Score of each row given its points (last axis, SHEET_KEYS order)"""
+        return points
+
+    def best_rows(self, row_scores, points):
+        """Chosen row index of each throw (last axis of row_scores and points)"""
+        # Same as best_evaluation: last row of SHEET_KEYS with the best score
+        return row_scores.shape[-1] - 1 - np.argmax(row_scores[..., ::-1], axis=-1)
+
+    def get_throw_table(self, sheet):
+        """Chosen row index and score of each of the 252 throws.
+        Memoized on the scoring state, so it is shared by every sheet (and
+        game) scoring throws the same way.
+        """
+        state = scoring_state(as_state(sheet))
+        throw_table = self.throw_cache.get(state)
+        if throw_table is None:
+            points = state_points(state)
+            row_scores = self.row_scores(points)
+            rows = self.best_rows(row_scores, points).astype(np.int8)
+            throw_table = (rows, row_scores[np.arange(len(rows)), rows])
+            self.throw_cache[state] = throw_table
+        return throw_table
+
+    def get_throw_tables(self, states):
+        """get_throw_table of an array of compact states: (n_states, 252) arrays"""
+        points = states_points(states)
+        row_scores = self.row_scores(points)
+        rows = self.best_rows(row_scores, points)
+        return rows, np.take_along_axis(row_scores, rows[..., None], axis=-1)[..., 0]
+
     def score_throw(self, sheet, throw):
-        return best_evaluation(get_sheet_points(sheet, throw))
+        rows, scores = self.get_throw_table(sheet)
+        i_throw = throw_index(throw)
+        return SHEET_KEYS[rows[i_throw]], scores[i_throw].item()
+
+    def score_all_throws(self, sheet):
+        """Score (best row score) of each of the 252 throws, as in score_throw"""
+        return self.get_throw_table(sheet)[1]
+
+    def aggregate_locks(self, throw, throw_scores):
+        """Aggregate of the reachable throw scores for each lock choice of a throw,
+        in THROW_KEEPS order (the order lock ties are broken in)"""
+        i_throw = throw_index(throw)
+        lock_values = aggregate_keeps(
+            throw_scores, THROW_KEEPS[i_throw, :THROW_N_KEEPS[i_throw]], self.lock_aggregate
+        )
+        return dict(zip(throw_locks(i_throw), lock_values.tolist()))
 
     def get_lock_score(self, sheet, throw):
-        lock_choices = powerset(throw)
-        lock_scores = dict()
-
-        for lock_choice in lock_choices:
-            all_random_throws = generate_all_throws(lock_choice)
-            random_throws_eval = [
-                self.score_throw(sheet, possible_throw)
-                for possible_throw in all_random_throws
-            ]
-            # Any aggregate function valid here
-            agg_score = np.mean([score[1] for score in random_throws_eval])
-            lock_scores[lock_choice] = agg_score
-        return lock_scores
+        return self.aggregate_locks(throw, self.score_all_throws(sheet))
+
+    def lock_scores(self, sheet, throw, is_first_lock=True):
+        """Score of each lock choice, as compared by lock_dice"""
+        return self.get_lock_score(sheet, throw)
+
+    def export_tree(self, sheet, throw, tree_file, **options):
+        """Streams the decision tree of a turn to tree_file, see tree_export.export_tree"""
+        return export_tree(self, sheet, throw, tree_file, **options)
 
     def lock_dice(self, sheet, throw, is_first_lock=True):
+        lock_choice = self.book_lock(sheet, throw, is_first_lock)
+        if lock_choice is not None:
+            return lock_choice
+
         lock_scores = self.get_lock_score(sheet, throw)
         # print(retain_scores)
         max_agg_score = max(lock_scores.values())
@@ -101,205 +310,215 @@ class YamsT1(YamsAgent):
         return best_recommendations[0]
 
     def choose_row(self, sheet, throw) -> List[Union[str, int]]:
-        # sheet_points = get_sheet_points(sheet, throw)
-        row, points = self.score_throw(sheet, throw)
-        if sheet[row] is not None:
-            row = self.eliminate_row(sheet)
+        row = self.book_row(sheet, throw)
+        if row is not None:
+            return row
+
+        state = as_state(sheet)
+        row, points = self.score_throw(state, throw)
+        if not is_row_open(state, row):
+            row = self.eliminate_row(state)
             points = 0
 
         return row
 
     def eliminate_row(self, sheet):
-        for k in [
-            "Yams",
-            1,
-            "Grande Suite",
-            "Petite Suite",
-            "Full",
-            2,
-            "Carré",
-            "Brelan",
-            3,
-            4,
-            5,
-            6,
-        ]:
-            if sheet[k] is None:
+        state = as_state(sheet)
+        for k in ELIMINATION_ORDER:
+            if is_row_open(state, k):
                 return k
-        print_pretty_sheet(sheet)
+        if isinstance(sheet, dict):
+            print_pretty_sheet(sheet)
         raise ValueError("The sheet seems full. Can't eliminate any row")
 
+    def lock_dice_many(self, states, throws, is_first_lock=True):
+        scoring, inverse = np.unique(scoring_states(states), return_inverse=True)
+        _, throw_scores = self.get_throw_tables(scoring)
+        keep_values = aggregate_keeps(throw_scores, aggregate=self.lock_aggregate)
+        return best_locks(keep_values, inverse, throws)
+
+    def choose_row_many(self, states, throws):
+        scoring, inverse = np.unique(scoring_states(states), return_inverse=True)
+        rows, _ = self.get_throw_tables(scoring)
+        return self.eliminate_rows(states, rows[inverse, throws])
+
+    def eliminate_rows(self, states, rows):
+        """Batched eliminate_row, only for the rows already filled"""
+        is_filled = (states >> rows) & 1 == 1
+        open_rows = OPEN_ROWS_TABLE[states & ROWS_MASK][:, ELIMINATION_COLUMNS]
+        eliminated = ELIMINATION_COLUMNS[np.argmax(open_rows, axis=1)]
+        return np.where(is_filled, eliminated, rows)
+
 
 class YamsRandom(YamsT1):
 
-    def lock_dice(self, sheet, throw, is_first_lock=True):
-        retain_choices = powerset(throw)
-        return np.random.choice(retain_choices)
+    is_deterministic = False
+    uses_game_rng = True
 
+    def __init__(self, seed=None, lock_aggregate="mean", book_file=None):
+        # Locks are drawn from the game's generator when one is given, else from
+        # the seed, else from the process generator (distinct in each worker).
+        # play_game and simulator.play_games always pass the game's generator:
+        # the seed only applies to direct lock_dice/lock_dice_many calls.
+        self.seed = seed
+        self.rng = None if seed is None else np.random.default_rng(seed)
+        super().__init__(lock_aggregate, book_file)
 
-class YamsT1E(YamsT1):
+    def get_config(self):
+        return {**super().get_config(), "seed": self.seed}
 
-    def __init__(self, points_power=1.5):
+    def get_rng(self, rng=None):
+        if rng is not None:
+            return rng
+        return default_rng() if self.rng is None else self.rng
 
+    def lock_dice(self, sheet, throw, is_first_lock=True, rng=None):
+        retain_choices = throw_locks(throw_index(throw))
+        return retain_choices[self.get_rng(rng).integers(len(retain_choices))]
+
+    def lock_dice_many(self, states, throws, is_first_lock=True, rng=None):
+        i_choices = self.get_rng(rng).integers(THROW_N_KEEPS[throws])
+        return THROW_KEEPS[throws, i_choices]
+
+
+class YamsT1E(YamsT1):
+
+    def __init__(self, points_power=1.5, lock_aggregate="mean", book_file=None):
         self.expected_scores = {k: np.max(SHEET_POSSIBLE_VALUES[k]) for k in SHEET_KEYS}
+        self.expected_array = np.array([self.expected_scores[k] for k in SHEET_KEYS])
         # To speed things up
         self.points_power = points_power
-        self.custom_power = {x: x**points_power for x in range(100)}
-        self.score_cache = {}
-
-    def score_throw(self, sheet, throw, is_first_lock=True):
-        sheet_hash = hash(json.dumps(sheet))
-        throw_hash = hash(throw)
-        sheet_points = get_sheet_points(sheet, throw)
-        if (sheet_hash, throw_hash) in self.score_cache:
-            return self.score_cache[(sheet_hash, throw_hash)]
-
-        row_scores = {
-            k: self.custom_power[sheet_points[k]] / self.expected_scores[k]
-            for k in sheet_points.keys()
-        }
-        max_score = max(row_scores.values())
-        best_options = [(k, v) for (k, v) in row_scores.items() if v == max_score]
-        if len(best_options) > 1:
-            best_options_by_points = list(
-                sorted(best_options, key=lambda x: -sheet_points[x[0]])
-            )
-            # print(throw, best_options, best_options_by_points)
-            final_score = best_options_by_points[0]
-        else:
-            # print(throw, best_options)
-            final_score = best_options[0]
+        self.custom_power = np.array([x**points_power for x in range(100)])
+        super().__init__(lock_aggregate, book_file)
+
+    def get_config(self):
+        return {**super().get_config(), "points_power": self.points_power}
+
+    def best_rows(self, row_scores, points):
+        # Ties broken by most points, then SHEET_KEYS order
+        is_best = row_scores == row_scores.max(axis=-1, keepdims=True)
+        return np.argmax(np.where(is_best, points, -1), axis=-1)
+
+    def row_scores(self, points):
+        return self.custom_power[points] / self.expected_array
+
 
-        self.score_cache[(sheet_hash, throw_hash)] = final_score
-        return final_score
-    
 class YamsT1T(YamsT1E):
 
     def __init__(self, 
                  target_scores_file='target_median_YamsT1E.json',
-                 points_power=1.5):
-        super().__init__(points_power=points_power)
-
-        with open(target_scores_file, encoding='utf-8') as target_file:
-            target_scores = json.load(target_file)
+                 points_power=1.5,
+                 lock_aggregate="mean",
+                 book_file=None):
+        self.target_scores_file = target_scores_file
         self.target_name = "_".join(
             target_scores_file.split('.')[0].split('_')[1:]
         )
+        # Read before the caches are created, as they are named after the targets
+        with open(target_scores_file, encoding='utf-8') as target_file:
+            target_scores = json.load(target_file)
         for i in range(1, 7):
             target_scores[i] = target_scores[str(i)]
             del target_scores[str(i)]
+        self.target_scores = target_scores
+        super().__init__(
+            points_power=points_power, lock_aggregate=lock_aggregate, book_file=book_file
+        )
         self.expected_scores = target_scores
+        self.expected_array = np.array([self.expected_scores[k] for k in SHEET_KEYS])
 
-    def score_throw(self, sheet, throw, is_first_lock=True):
-        sheet_hash = hash(json.dumps(sheet))
-        throw_hash = hash(throw)
-        sheet_points = get_sheet_points(sheet, throw)
-        if (sheet_hash, throw_hash) in self.score_cache:
-            return self.score_cache[(sheet_hash, throw_hash)]
+    def get_config(self):
+        return {**super().get_config(), "target_scores_file": self.target_scores_file}
 
-        row_scores = {
-            k: 2*sheet_points[k] - self.expected_scores[k]
-            for k in SHEET_KEYS
-        }
+    def cache_config(self):
+        # The file can be rewritten with other targets (see sheet_analysis.ipynb)
+        targets = [self.target_scores[k] for k in SHEET_KEYS]
+        return {**super().cache_config(), "targets": targets}
 
-        max_score = max(row_scores.values())
-        best_options = [(k, v) for (k, v) in row_scores.items() if v == max_score]
-        if len(best_options) > 1:
-            best_options_by_points = list(
-                sorted(best_options, key=lambda x: -sheet_points[x[0]])
-            )
-            final_score = best_options_by_points[0]
-        else:
-            final_score = best_options[0]
+    def row_scores(self, points):
+        return 2*points - self.expected_array
 
-        self.score_cache[(sheet_hash, throw_hash)] = final_score
-        return final_score
-    
     def __str__(self):
         return f'{self.__class__.__name__}_{self.target_name}'
 
 
-class YamsT2(YamsT1):
-    """Agent looking at throws at maximum "depth 2" (thus T2).
-    To lock dice, we look at
-    1. All possible lock choices
-    2. All possible random throws (each one is equipossible)
-        a. All possible lock choices for each random throw
-        b. All possible random throws for each secondary lock choice
-        c. Score each random throw of each secondary lock choice
-    3. Scoring each primary lock choice with mean of each random throw post second. lock
-    4. Aggregating for each retain choice the scores with mean
-    5. Choosing the retain choice with best mean score
+class Depth2Mixin:
+    """First locks of YamsT2 and YamsT2KE, searched at depth 2 (see search.TurnSearch),
+    other decisions are left to the next class of the MRO.
+    Subclasses set max_nodes, time_limit and create the caches with init_search_caches.
     """
 
-    def __init__(
-        self,
-    ):
-
-        self.lock_cache = {}
-        self.lock_cache_hit = 0
-        self.lock_cache_missed = 0
-
-        self.score_cache = {}
-        self.score_cache_hit = 0
-        self.score_cache_missed = 0
+    # Number of best depth 1 keeps searched at depth 2 (all if None)
+    topk = None
+    # Aggregation of the second throws' values (TurnSearch's by default)
+    root_aggregate = None
+
+    def init_search_caches(self):
+        # Lock scores (dicts of up to 32 locks) are 2-4kB each
+        self.lock_cache = self.get_cache("lock", maxsize=1 << 14)
+        # Searches are ~6kB each, kept for every decision of their state, and
+        # expanded after insertion: an on-disk store would only hold empty ones
+        self.search_cache = self.get_cache("search", maxsize=1 << 12, persist=False)
+
+    @property
+    def lock_cache_hit(self):
+        return self.lock_cache.hits
+
+    @property
+    def lock_cache_missed(self):
+        return self.lock_cache.misses
+
+    @property
+    def is_deterministic(self):
+        # Budgets are spent on the nodes a cached search has not expanded yet, so
+        # bounded decisions depend on the decisions made before (and on the
+        # machine's speed for time_limit)
+        return self.max_nodes is None and self.time_limit is None
+
+    def get_search(self, state):
+        search = self.search_cache.get(state)
+        if search is None:
+            search = TurnSearch(
+                self.score_all_throws(state),
+                self.lock_aggregate,
+                root_aggregate=self.root_aggregate,
+            )
+            self.search_cache[state] = search
+        return search
 
-    def score_throw(self, sheet, throw):
-        sheet_hash = hash(json.dumps(sheet))
-        throw_hash = hash(throw)
-        if (sheet_hash, throw_hash) in self.score_cache:
-            self.score_cache_hit += 1
-            return self.score_cache[(sheet_hash, throw_hash)]
+    def get_lock_score(self, sheet, throw, recursive=False):
+        state = scoring_state(as_state(sheet))
+        throw_idx = throw_index(throw)
+        lock_scores = self.lock_cache.get((state, throw_idx, recursive))
+        if lock_scores is not None:
+            return lock_scores
 
-        score = super().score_throw(sheet, throw)
-        self.score_cache_missed += 1
-        self.score_cache[(sheet_hash, throw_hash)] = score
-        return score
+        if recursive:
+            keep_values = self.get_search(state).lock_values(
+                throw_idx,
+                max_keeps=self.topk,
+                max_nodes=self.max_nodes,
+                time_limit=self.time_limit,
+            )
+            lock_scores = search_lock_scores(throw, keep_values)
+        else:
+            # Normal depth 1 lock scores
+            lock_scores = self.aggregate_locks(throw, self.score_all_throws(state))
 
-    def get_lock_score(self, sheet, throw, recursive=False):
-        sheet_hash = hash(json.dumps(sheet))
-        throw_hash = hash(throw)
-        if (sheet_hash, throw_hash, recursive) in self.lock_cache:
-            self.lock_cache_hit += 1
-            return self.lock_cache[(sheet_hash, throw_hash, recursive)]
-
-        self.lock_cache_missed += 1
-
-        lock_choices = powerset(throw)
-        lock_scores = dict()
-
-        for lock_choice in lock_choices:
-            all_random_throws = generate_all_throws(lock_choice)
-            if recursive:
-                random_throws_lock_scores = [
-                    self.get_lock_score(sheet, random_throw, recursive=False)
-                    for random_throw in all_random_throws
-                ]
-                random_throws_scores = []
-                for random_throw_lock_score in random_throws_lock_scores:
-                    random_throws_scores.extend(random_throw_lock_score.values())
-                agg_score = np.mean(random_throws_scores)
-                # print(f"Got lock score for {lock_choice}: ({agg_score:.2f} {recursive})")
-
-            else:
-                # Normal
-                random_throws_eval = [
-                    self.score_throw(sheet, possible_throw)
-                    for possible_throw in all_random_throws
-                ]
-                # Any aggregate function valid here
-                agg_score = np.mean([score[1] for score in random_throws_eval])
-            lock_scores[lock_choice] = agg_score
-
-        self.lock_cache[(sheet_hash, throw_hash, recursive)] = lock_scores
+        self.lock_cache[(state, throw_idx, recursive)] = lock_scores
         return lock_scores
 
+    def lock_scores(self, sheet, throw, is_first_lock=True):
+        return self.get_lock_score(sheet, throw, recursive=is_first_lock)
+
     def lock_dice(self, sheet, throw, is_first_lock=False):
         if not is_first_lock:
-            return super().lock_dice(sheet, throw)
+            return super().lock_dice(sheet, throw, is_first_lock)
+        lock_choice = self.book_lock(sheet, throw, is_first_lock)
+        if lock_choice is not None:
+            return lock_choice
 
         lock_scores = self.get_lock_score(sheet, throw, recursive=is_first_lock)
-        # print(retain_scores)
         max_agg_score = max(lock_scores.values())
         best_recommendations = [
             lock_choice
@@ -308,122 +527,182 @@ class YamsT2(YamsT1):
         ]
         return best_recommendations[0]
 
-    def choose_row(self, sheet, throw) -> List[Union[str, int]]:
-        # sheet_points = get_sheet_points(sheet, throw)
-        row, points = self.score_throw(sheet, throw)
-        if sheet[row] is not None:
-            row = self.eliminate_row(sheet)
-            points = 0
+    def lock_dice_many(self, states, throws, is_first_lock=True):
+        if not is_first_lock:
+            return super().lock_dice_many(states, throws, is_first_lock)
+        if self.max_nodes is not None or self.time_limit is not None:
+            # Budgets bound each decision: decided one by one
+            return YamsAgent.lock_dice_many(self, states, throws, is_first_lock)
+        return self.first_locks_many(states, throws)
+
+    def first_locks_many(self, states, throws):
+        """Unbounded first locks (KEEPS indices) of arrays of states and throw indices"""
+        scoring, inverse = np.unique(scoring_states(states), return_inverse=True)
+        if self.topk is None:
+            # Pruned keeps can't beat the best one, so full expansions choose alike
+            keep_values = np.array([
+                self.get_search(state).root_values() for state in scoring.tolist()
+            ])
+            return best_locks(keep_values, inverse, throws)
+
+        searches = [self.get_search(state) for state in scoring.tolist()]
+        depth1_values = np.array([search.depth1_values(slice(None)) for search in searches])
+
+        # Else as TurnSearch.lock_values: the topk keeps of best depth 1 value
+        # get their depth 2 value, the others keep their depth 1 value
+        lock_choices = THROW_KEEPS[throws]
+        is_lock = np.arange(THROW_KEEPS.shape[1]) < THROW_N_KEEPS[throws][:, None]
+        lock_values = np.where(is_lock, depth1_values[inverse[:, None], lock_choices], -np.inf)
+        order = np.argsort(-lock_values, axis=1, kind="stable")
+        ranks = np.argsort(order, axis=1, kind="stable")
+        is_searched = is_lock & (ranks < self.topk)
+        # Depth 2 values of the searched keeps only
+        root_values = np.full_like(depth1_values, np.nan)
+        i_states = np.broadcast_to(inverse[:, None], lock_choices.shape)
+        for i, search in enumerate(searches):
+            keeps = np.unique(lock_choices[is_searched & (i_states == i)])
+            root_values[i, keeps] = search.root_values(keeps)
+        lock_values = np.where(
+            is_searched, root_values[inverse[:, None], lock_choices], lock_values
+        )
+        return lock_choices[np.arange(len(throws)), np.argmax(lock_values, axis=1)]
 
-        return row
 
-class YamsT2KE(YamsT1E):
+class YamsT2(Depth2Mixin, YamsT1):
     """Agent looking at throws at maximum "depth 2" (thus T2).
-    To lock dice, we look at
+    To lock dice the first time, we search (see search.TurnSearch)
     1. All possible lock choices
-    2. All possible random throws (each one is equipossible)
+    2. All possible random throws, with their exact probability
         a. All possible lock choices for each random throw
         b. All possible random throws for each secondary lock choice
         c. Score each random throw of each secondary lock choice
-    3. Scoring each primary lock choice with mean of each random throw post second. lock
-    4. Aggregating for each retain choice the scores with mean
-    5. Choosing the retain choice with best mean score
+    3. Scoring each random throw with its best secondary lock choice
+    4. Aggregating for each lock choice the scores with their expectation
+    5. Choosing the lock choice with best score
+    Each decision can be bounded by a node or time budget.
     """
 
+    def __init__(self, lock_aggregate="mean", max_nodes=None, time_limit=None, book_file=None):
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        super().__init__(lock_aggregate, book_file)
+        self.init_search_caches()
+
+    def get_config(self):
+        return {
+            **super().get_config(),
+            "max_nodes": self.max_nodes,
+            "time_limit": self.time_limit,
+        }
+
+
+class YamsT2KE(Depth2Mixin, YamsT1E):
+    """Agent looking at throws at maximum "depth 2" (thus T2).
+    To lock dice the first time, we search (see search.TurnSearch)
+    1. The topk lock choices with best T1 scores
+    2. All possible random throws, with their exact probability
+        a. All possible lock choices for each random throw
+        b. All possible random throws for each secondary lock choice
+        c. Score each random throw of each secondary lock choice
+    3. Scoring each random throw with its best secondary lock choice
+    4. Aggregating for each lock choice the scores with their probability weighted median
+    5. Choosing the lock choice with best median score
+    Each decision can be bounded by a node or time budget.
+    """
+
+    root_aggregate = "median"
+
     def __init__(
-        self, topk=5, points_power=1.5
+        self,
+        topk=5,
+        points_power=1.5,
+        lock_aggregate="mean",
+        max_nodes=None,
+        time_limit=None,
+        book_file=None,
     ):
-        super().__init__(points_power)
         self.topk = topk
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        super().__init__(points_power, lock_aggregate, book_file)
+        self.init_search_caches()
+
+    def get_config(self):
+        return {
+            **super().get_config(),
+            "topk": self.topk,
+            "max_nodes": self.max_nodes,
+            "time_limit": self.time_limit,
+        }
 
-        self.lock_cache = {}
-        self.lock_cache_hit = 0
-        self.lock_cache_missed = 0
 
-        self.score_cache = {}
-        self.score_cache_hit = 0
-        self.score_cache_missed = 0
+class YamsOptimal(YamsAgent):
+    """Agent playing the exact optimal strategy (maximal expected score).
+    State values are solved once by retrograde dynamic programming
+    (see solver.py), stored in `values_file` (solver.VALUES_FILE by default)
+    and memory-mapped. Each turn policy is then derived from the values of
+    the reachable next states.
+    """
 
-    def score_throw(self, sheet, throw):
-        sheet_hash = hash(json.dumps(sheet))
-        throw_hash = hash(throw)
-        if (sheet_hash, throw_hash) in self.score_cache:
-            self.score_cache_hit += 1
-            return self.score_cache[(sheet_hash, throw_hash)]
+    def __init__(self, values_file=None):
+        self.values_file = values_file
+        self.values = load_values(values_file)
+        # Turn policies are ~9.4kB each
+        self.policy_cache = self.get_cache("policy", maxsize=1 << 12)
 
-        score = super().score_throw(sheet, throw)
-        self.score_cache_missed += 1
-        self.score_cache[(sheet_hash, throw_hash)] = score
-        return score
+    def get_config(self):
+        return {"values_file": self.values_file}
 
-    def get_lock_score(self, sheet, throw, recursive=False):
-        sheet_hash = hash(json.dumps(sheet))
-        throw_hash = hash(throw)
-        if (sheet_hash, throw_hash, recursive) in self.lock_cache:
-            self.lock_cache_hit += 1
-            return self.lock_cache[(sheet_hash, throw_hash, recursive)]
+    def __getstate__(self):
+        # Unpickled agents memory-map the values file instead of copying it
+        return {k: v for (k, v) in self.__dict__.items() if k != "values"}
 
-        self.lock_cache_missed += 1
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.values = load_values(self.values_file)
 
-        # Normal T1 lock scores
-        lock_scores = super().get_lock_score(sheet, throw)
-        if not recursive:
-            return lock_scores
-        
-        # Reducing lock choices to maximum topk choices
-        topk_score = sorted(lock_scores.values(), reverse=True)[self.topk]
-        lock_choices = [
-            lock_choice 
-            for (lock_choice, lock_score) in lock_scores.items()
-            if lock_score >= topk_score
-        ] if len(lock_scores) > self.topk else lock_scores.keys()
-
-        
-        for lock_choice in lock_choices:
-            all_random_throws = generate_all_throws(lock_choice)
-            random_throws_lock_scores = [
-                self.get_lock_score(sheet, random_throw, recursive=False)
-                for random_throw in all_random_throws
-            ]
-            random_throws_scores = []
-            for random_throw_lock_score in random_throws_lock_scores:
-                random_throws_scores.extend(random_throw_lock_score.values())
-            agg_score = np.median(random_throws_scores)
-            # print(f"Got lock score for {lock_choice}: ({agg_score:.2f} {recursive})")
-
-            lock_scores[lock_choice] = agg_score
-
-        self.lock_cache[(sheet_hash, throw_hash, recursive)] = lock_scores
-        return lock_scores
+    def get_policy(self, sheet):
+        state = as_state(sheet)
+        policy = self.policy_cache.get(state)
+        if policy is None:
+            policy = TurnPolicy(self.values, state)
+            self.policy_cache[state] = policy
+        return policy
 
-    def lock_dice(self, sheet, throw, is_first_lock=False):
-        if not is_first_lock:
-            return super().lock_dice(sheet, throw)
+    def expected_score(self, sheet):
+        """Expected points still to score from this sheet with optimal play"""
+        state = as_state(sheet)
+        return float(self.values[playable_mask(state), state >> BALANCE_SHIFT])
 
-        lock_scores = self.get_lock_score(sheet, throw, recursive=is_first_lock)
-        # print(retain_scores)
-        max_agg_score = max(lock_scores.values())
-        best_recommendations = [
-            lock_choice
-            for (lock_choice, score) in lock_scores.items()
-            if score == max_agg_score
-        ]
-        return best_recommendations[0]
+    def lock_dice(self, sheet, throw, is_first_lock=True):
+        return self.get_policy(sheet).lock(throw_index(throw), is_first_lock)
 
-    def choose_row(self, sheet, throw) -> List[Union[str, int]]:
-        # sheet_points = get_sheet_points(sheet, throw)
-        row, points = self.score_throw(sheet, throw)
-        if sheet[row] is not None:
-            row = self.eliminate_row(sheet)
-            points = 0
+    def choose_row(self, sheet, throw):
+        return self.get_policy(sheet).row(throw_index(throw))
 
-        return row
+    def lock_dice_many(self, states, throws, is_first_lock=True):
+        unique_states, inverse = np.unique(states, return_inverse=True)
+        policies = [self.get_policy(state) for state in unique_states.tolist()]
+        keep_values = np.array([
+            policy.first_keep_values if is_first_lock else policy.second_keep_values
+            for policy in policies
+        ])
+        return best_locks(keep_values, inverse, throws)
+
+    def choose_row_many(self, states, throws):
+        unique_states, inverse = np.unique(states, return_inverse=True)
+        final_rows = np.array([
+            self.get_policy(state).final_rows for state in unique_states.tolist()
+        ])
+        return np.asarray(ROW_COLUMNS)[final_rows[inverse, throws]]
 
 
 class YamsHuman(YamsAgent):
 
+    is_deterministic = False
+
     def lock_dice(self, sheet, throw):
-        retain_choices = powerset(throw)
+        retain_choices = throw_locks(throw_index(throw))
         user_lock = input(f"Which dice from {throw} do you want to lock?\n")
         try:
             user_choice = tuple(int(elem) for elem in user_lock)
@@ -1,16 +1,17 @@
 from tqdm import tqdm
-from p_tqdm import p_map
-import os
-
-from yams import play_game
+from evaluation import evaluate_agent, load_checkpoint
+from runner import GameRunner
+from profiling import summarize
+import json
 import numpy as np
 from time import time
 from agents import (
     YamsRandom, YamsT1, YamsT1E, YamsT1T, YamsT2, YamsT2KE
 )
 import matplotlib.pyplot as plt
-from multiprocessing import Pool
-import json
+
+# Same game seeds for every agent (common random numbers), reproducible runs
+SEED = 0
 
 agents = [
     (YamsRandom(), 5000),
@@ -21,37 +22,58 @@ agents = [
     (YamsT2KE(topk=3), 500)
 ]
 
-t0 = time()
-for agent, n_samples in agents:
-    game_scores = []
-    # p_bar = tqdm(range(n_samples))
-    print("Agent:", agent)
-    p_bar = p_map(
-        play_game, 
-        [agent]*n_samples,
-        [False]*n_samples,
-        [True]*n_samples
-    )
-        
-    i_sample = 0
-    for final_sheet in p_bar:
-        
-        score = sum(final_sheet.values())
-        game_scores.append(score)
-        # p_bar.set_postfix_str(np.median(game_scores))
-        os.makedirs(f'data/sheets/{agent}/', exist_ok=True)
-        with open(f'data/sheets/{agent}/sheet_{i_sample:05}.json', 'w') as file:
-            json.dump(final_sheet, file)
-        i_sample += 1
-        
-    gs_mean = np.median(game_scores)
+STORE_FILE = 'data/results.bin'
+CHUNK_SIZE = 100
+PLOT_EVERY = 10  # chunks
+# Decision latencies, call counts and cache hit rates of the workers
+PROFILE = False
+PROFILE_FILE = 'data/profile.json'
 
+
+def plot_scores(stats, agent):
+    scores = np.arange(len(stats.score_counts))
     fig = plt.figure(figsize=(12, 4))
-    val, bins, _ = plt.hist(game_scores, density=True, bins=min(50, len(game_scores)))
-    plt.plot([gs_mean]*2, [0, val.max()], c='red')
-    plt.annotate(f"Median: {gs_mean:.1f}", (gs_mean, 1e-3), c='red')
-    plt.title(f'Agent: {agent}, sample size: {len(game_scores)}')
+    plt.bar(scores, stats.score_counts / stats.n_games, width=1)
+    plt.plot([stats.median]*2, [0, stats.score_counts.max() / stats.n_games], c='red')
+    plt.annotate(f"Median: {stats.median:.1f}", (stats.median, 1e-3), c='red')
+    plt.xlim(scores[stats.score_counts > 0].min() - 5, scores[stats.score_counts > 0].max() + 5)
+    plt.title(f'Agent: {agent}, sample size: {stats.n_games}')
     plt.savefig(f"data/scores_distribution/{agent}.jpg")
     plt.close()
 
-print("Total execution time:", time()-t0)
\ No newline at end of file
+
+t0 = time()
+runner = GameRunner([agent for agent, _ in agents], chunk_size=CHUNK_SIZE, profile=PROFILE)
+with runner:
+    for agent, n_samples in agents:
+        print("Agent:", agent)
+        checkpoint_file = f'data/checkpoints/{agent}.json'
+        checkpoint = load_checkpoint(checkpoint_file, agent, SEED)
+        n_played = checkpoint.n_games if checkpoint is not None else 0
+        evaluation = evaluate_agent(
+            agent,
+            n_samples,
+            seed=SEED,
+            chunk_size=CHUNK_SIZE,
+            checkpoint_file=checkpoint_file,
+            store_file=STORE_FILE,
+            map_func=runner.imap,
+        )
+        # Only the chunks not covered by the checkpoint are played
+        n_chunks = len(range(n_played, n_samples, CHUNK_SIZE))
+        p_bar = tqdm(evaluation, total=n_chunks or 1, unit='chunk')
+        stats = None
+        for i_chunk, stats in enumerate(p_bar):
+            p_bar.set_postfix_str(
+                f"{stats.n_games} games, mean {stats.mean:.1f} ± {stats.std:.1f}, median {stats.median}"
+            )
+            if i_chunk % PLOT_EVERY == 0 and stats.n_games:
+                plot_scores(stats, agent)
+        if stats is not None and stats.n_games:
+            plot_scores(stats, agent)
+
+if PROFILE:
+    with open(PROFILE_FILE, 'w') as file:
+        json.dump(summarize(runner.profile_report()), file, indent=2)
+
+print("Total execution time:", time()-t0)
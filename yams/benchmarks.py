@@ -0,0 +1,210 @@
+"""Benchmark suite with fixed seeds.
+Microbenchmarks time the scoring primitives and single agent decisions,
+macrobenchmarks time whole games of each agent and record their score
+distribution. Results are compared to a baseline JSON file: the run fails
+(exit code 1) when a throughput drops or a mean score decreases beyond the
+tolerances.
+
+    python benchmarks.py                    # compare to benchmarks_baseline.json
+    python benchmarks.py --update-baseline  # write the baseline
+"""
+import argparse
+import json
+import platform
+import sys
+from time import perf_counter
+
+import numpy as np
+from agents import (
+    YamsOptimal,
+    YamsRandom,
+    YamsT1,
+    YamsT1E,
+    YamsT1T,
+    YamsT2,
+    YamsT2KE,
+    generate_all_throws,
+    powerset,
+)
+from caches import clear_caches
+from evaluation import ScoreStats
+from yams import (
+    SHEET_KEYS,
+    THROWS,
+    check_grande_suite,
+    check_petite_suite,
+    encode_sheet,
+    game_seeds,
+    get_sheet_points,
+    play_game,
+    play_round,
+)
+
+SEED = 0
+BASELINE_FILE = "benchmarks_baseline.json"
+
+
+def benchmark_agents():
+    """Agents and their number of benchmark games"""
+    return [
+        # The seed fixes the microbenchmark locks, games use their own generator
+        (YamsRandom(seed=SEED), 500),
+        (YamsT1(), 500),
+        (YamsT1E(), 500),
+        (YamsT1T(), 500),
+        (YamsT2(), 200),
+        (YamsT2KE(topk=3), 200),
+        (YamsOptimal(), 200),
+    ]
+
+
+def time_calls(func, args_list, repeat=5, setup=None, min_time=0.05):
+    """Calls per second of func over args_list, best of `repeat` runs.
+    Each run calls setup() first, then loops over args_list for at least
+    min_time seconds (a single pass if setup is given, e.g. to clear caches)."""
+    best = 0.0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        n_calls, duration = 0, 0.0
+        t0 = perf_counter()
+        while duration < min_time or n_calls == 0:
+            for args in args_list:
+                func(*args)
+            n_calls += len(args_list)
+            duration = perf_counter() - t0
+            if setup is not None:
+                break
+        best = max(best, n_calls / duration)
+    return best
+
+
+def decision_samples(n_games=20, seed=SEED):
+    """Sheets (dicts) and throws met at the start of the rounds of seeded games"""
+    agent = YamsT1()
+    sheets = []
+    for game_seed in game_seeds(n_games, seed):
+        rng = np.random.default_rng(game_seed)
+        sheet = {k: None for k in SHEET_KEYS}
+        while None in sheet.values():
+            sheets.append(dict(sheet))
+            play_round(sheet, agent, verbose=False, rng=rng)
+    rng = np.random.default_rng(seed)
+    throws = [THROWS[i] for i in rng.integers(len(THROWS), size=len(sheets))]
+    return sheets, throws
+
+
+def run_micro(agents, quick=False):
+    sheets, throws = decision_samples(5 if quick else 20)
+    states = [encode_sheet(sheet) for sheet in sheets]
+    results = {
+        "get_sheet_points": time_calls(get_sheet_points, list(zip(sheets, throws))),
+        "powerset": time_calls(powerset, [(throw,) for throw in throws]),
+        "generate_all_throws": time_calls(
+            generate_all_throws, [(throw[:i % 6],) for (i, throw) in enumerate(throws)]
+        ),
+        "check_petite_suite": time_calls(check_petite_suite, [(throw,) for throw in THROWS]),
+        "check_grande_suite": time_calls(check_grande_suite, [(throw,) for throw in THROWS]),
+    }
+    for agent, _ in agents:
+        # Decisions from cold caches
+        for name, decide in (
+            ("first_lock", lambda s, t: agent.lock_dice(s, t, is_first_lock=True)),
+            ("second_lock", lambda s, t: agent.lock_dice(s, t, is_first_lock=False)),
+            ("choose_row", agent.choose_row),
+        ):
+            results[f"{agent}.{name}"] = time_calls(
+                decide, list(zip(states, throws)), setup=clear_caches
+            )
+    return results
+
+
+def run_macro(agents, quick=False):
+    results = {}
+    for agent, n_games in agents:
+        n_games = max(n_games // 10, 10) if quick else n_games
+        clear_caches()
+        t0 = perf_counter()
+        sheets = [
+            play_game(agent, return_sheet=True, seed=game_seed)
+            for game_seed in game_seeds(n_games, SEED)
+        ]
+        duration = perf_counter() - t0
+        stats = ScoreStats().update([[sheet[k] for k in SHEET_KEYS] for sheet in sheets])
+        summary = stats.summary()
+        results[str(agent)] = {
+            "n_games": n_games,
+            "games_per_s": n_games / duration,
+            **{k: summary[k] for k in ("mean", "std", "quantiles")},
+        }
+    return results
+
+
+def compare(results, baseline, throughput_tolerance=0.3, score_tolerance=0.5):
+    """Regressions of the results with respect to the baseline, as messages"""
+    regressions = []
+    for name, ops_per_s in results["micro"].items():
+        reference = baseline["micro"].get(name)
+        if reference is not None and ops_per_s < (1 - throughput_tolerance) * reference:
+            regressions.append(f"{name}: {ops_per_s:.0f}/s, baseline {reference:.0f}/s")
+    for name, macro in results["macro"].items():
+        reference = baseline["macro"].get(name)
+        # Same seeds and number of games: scores only move if play changed, and
+        # throughputs are not skewed by the share of games played on cold caches
+        if reference is None or macro["n_games"] != reference["n_games"]:
+            continue
+        if macro["games_per_s"] < (1 - throughput_tolerance) * reference["games_per_s"]:
+            regressions.append(
+                f"{name}: {macro['games_per_s']:.1f} games/s, "
+                f"baseline {reference['games_per_s']:.1f} games/s"
+            )
+        if macro["mean"] < reference["mean"] - score_tolerance:
+            regressions.append(
+                f"{name}: mean score {macro['mean']:.2f}, baseline {reference['mean']:.2f}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument(
+        "--quick", action="store_true",
+        help="10x fewer games and samples (macrobenchmarks are not compared)",
+    )
+    parser.add_argument("--throughput-tolerance", type=float, default=0.3)
+    parser.add_argument("--score-tolerance", type=float, default=0.5)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    agents = benchmark_agents()
+    results = {
+        "machine": {"python": platform.python_version(), "numpy": np.__version__},
+        "seed": SEED,
+        "micro": run_micro(agents, args.quick),
+        "macro": run_macro(agents, args.quick),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.throughput_tolerance, args.score_tolerance)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    if not regressions:
+        print("No regression")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Opening book of whole turn policies.
+The first rounds of every game start from a small set of sheet states. The
+book stores, for the states an agent visits most, its decisions for every
+throw of the turn (first lock, second lock and row), so agents loading it
+look them up instead of searching.
+"""
+import json
+from collections import Counter
+
+import numpy as np
+from dice_tables import KEEPS
+from yams import SHEET_KEYS, THROWS, encode_sheet, game_seeds, play_round
+
+
+def book_config(agent):
+    """Config of the agent the book decisions depend on"""
+    return {k: v for (k, v) in agent.get_config().items() if k != "book_file"}
+
+
+class OpeningBook:
+    """Turn policies of compact states: for each state and throw index, the
+    first and second lock (KEEPS indices) and the row (SHEET_KEYS index)."""
+
+    def __init__(self, states, first_locks, second_locks, rows, agent_name="", config="{}"):
+        self.states = np.asarray(states, dtype=np.int64)
+        self.first_locks = np.asarray(first_locks, dtype=np.int16)
+        self.second_locks = np.asarray(second_locks, dtype=np.int16)
+        self.rows = np.asarray(rows, dtype=np.int8)
+        self.agent_name = agent_name
+        self.config = config
+        self.index = {state: i for (i, state) in enumerate(self.states.tolist())}
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, state):
+        return state in self.index
+
+    def lock(self, state, throw_idx, is_first_lock=True):
+        """Kept dice tuple, None if the state is not in the book"""
+        i = self.index.get(state)
+        if i is None:
+            return None
+        locks = self.first_locks if is_first_lock else self.second_locks
+        return KEEPS[locks[i, throw_idx]]
+
+    def row(self, state, throw_idx):
+        """Chosen row, None if the state is not in the book"""
+        i = self.index.get(state)
+        if i is None:
+            return None
+        return SHEET_KEYS[self.rows[i, throw_idx]]
+
+    def is_for(self, agent):
+        return self.agent_name == agent.__class__.__name__ and self.config == json.dumps(
+            book_config(agent), sort_keys=True, default=str
+        )
+
+    def save(self, book_file):
+        with open(book_file, "wb") as file:
+            np.savez_compressed(
+                file,
+                states=self.states,
+                first_locks=self.first_locks,
+                second_locks=self.second_locks,
+                rows=self.rows,
+                agent_name=self.agent_name,
+                config=self.config,
+            )
+
+    @classmethod
+    def load(cls, book_file):
+        with np.load(book_file) as data:
+            return cls(
+                data["states"],
+                data["first_locks"],
+                data["second_locks"],
+                data["rows"],
+                str(data["agent_name"]),
+                str(data["config"]),
+            )
+
+
+def visited_states(agent, n_games=1000, max_rounds=3, seed=0):
+    """Number of visits of the states starting each of the first max_rounds rounds"""
+    visits = Counter()
+    for game_seed in game_seeds(n_games, seed):
+        rng = np.random.default_rng(game_seed)
+        sheet = {k: None for k in SHEET_KEYS}
+        for _ in range(max_rounds):
+            visits[encode_sheet(sheet)] += 1
+            play_round(sheet, agent, verbose=False, rng=rng)
+    return visits
+
+
+def build_book(agent, n_games=1000, max_rounds=3, max_states=500, min_visits=2, seed=0):
+    """Book of the (at most max_states) states the agent visits most often in
+    the first max_rounds rounds of n_games games"""
+    if not agent.is_deterministic:
+        raise ValueError(f"{agent} is not deterministic, its decisions can't be tabled")
+    visits = visited_states(agent, n_games, max_rounds, seed)
+    states = [
+        state for (state, n_visits) in visits.most_common(max_states) if n_visits >= min_visits
+    ]
+    throws = np.arange(len(THROWS))
+    first_locks, second_locks, rows = [], [], []
+    for state in states:
+        states_array = np.full(len(throws), state)
+        first_locks.append(agent.lock_dice_many(states_array, throws, is_first_lock=True))
+        second_locks.append(agent.lock_dice_many(states_array, throws, is_first_lock=False))
+        rows.append(agent.choose_row_many(states_array, throws))
+    n_throws = len(throws)
+    return OpeningBook(
+        states,
+        np.reshape(first_locks, (-1, n_throws)),
+        np.reshape(second_locks, (-1, n_throws)),
+        np.reshape(rows, (-1, n_throws)),
+        agent.__class__.__name__,
+        json.dumps(book_config(agent), sort_keys=True, default=str),
+    )
+
+
+if __name__ == "__main__":
+    from agents import YamsT1E, YamsT2KE
+
+    for agent in (YamsT1E(), YamsT2KE(topk=3)):
+        book = build_book(agent)
+        book_file = f"book_{agent}.npz"
+        book.save(book_file)
+        print(f"{agent}: {len(book)} states written to {book_file}")
@@ -0,0 +1,184 @@
+"""Agent caches.
+Size-bounded LRU caches with hit/miss/eviction counters, shared by all the
+agents of a process using the same namespace (agent class and the parameters
+of its cached values, see YamsAgent.cache_config).
+An optional on-disk store (sqlite) lets worker processes warm each other up.
+"""
+import atexit
+import os
+import pickle
+import sqlite3
+from collections import OrderedDict
+
+# Part of the on-disk namespaces: bump it when cached values change meaning
+CACHE_VERSION = 1
+CACHE_SETTINGS = {
+    "maxsize": 1 << 16,
+    "store_file": None,
+}
+_shared_caches = {}
+
+
+class SqliteStore:
+    """Cache entries of one namespace in a sqlite file, shared between processes.
+    Writes are buffered and flushed every `flush_every` entries, by flush_stores
+    and at exit. Pool workers exit without running atexit, so the runner
+    flushes their stores after each task.
+    """
+
+    def __init__(self, filename, namespace, flush_every=1024):
+        self.filename = filename
+        self.namespace = namespace
+        self.flush_every = flush_every
+        self.pending = []
+        self._connection = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    @property
+    def connection(self):
+        # sqlite connections must not be shared with forked processes
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.filename, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(namespace TEXT, key BLOB, value BLOB, PRIMARY KEY (namespace, key))"
+            )
+            self._pid = os.getpid()
+            self.pending = []
+        return self._connection
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, pickle.dumps(key)),
+        ).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def set(self, key, value):
+        # Connecting first drops the pending writes inherited from a parent process
+        self.connection
+        self.pending.append((self.namespace, pickle.dumps(key), pickle.dumps(value)))
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending or self._pid != os.getpid():
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO cache VALUES (?, ?, ?)", self.pending
+            )
+        self.pending = []
+
+
+class LRUCache:
+    """Least recently used cache of at most `maxsize` entries.
+    Missing keys are looked up in the optional `store` before counting a miss.
+    Pickling a cache only pickles its namespace: unpickled copies (e.g. agents
+    sent to worker processes) use the shared cache of their own process.
+    Caches with persist=False never get an on-disk store.
+    """
+
+    def __init__(self, namespace="", maxsize=None, store=None, persist=True):
+        self.namespace = namespace
+        self.maxsize = CACHE_SETTINGS["maxsize"] if maxsize is None else maxsize
+        self.store = store
+        self.persist = persist
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            pass
+        else:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self.hits += 1
+                self._insert(key, value)
+                return value
+
+        self.misses += 1
+        return default
+
+    def _insert(self, key, value):
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def __setitem__(self, key, value):
+        self._insert(key, value)
+        if self.store is not None:
+            self.store.set(key, value)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        n_lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / n_lookups if n_lookups else 0.0,
+        }
+
+    def __reduce__(self):
+        store_file = self.store.filename if self.store is not None else None
+        return shared_cache, (self.namespace, self.maxsize, store_file, self.persist)
+
+
+def configure(maxsize=None, store_file=None):
+    """Settings of the shared caches created from now on"""
+    if maxsize is not None:
+        CACHE_SETTINGS["maxsize"] = maxsize
+    CACHE_SETTINGS["store_file"] = store_file
+
+
+def shared_cache(namespace, maxsize=None, store_file=None, persist=True):
+    """Cache of this process for a namespace, created on first use.
+    persist=False keeps it in memory only, for values that are filled in after
+    their insertion (the store pickles them when they are set)."""
+    if namespace not in _shared_caches:
+        if store_file is None:
+            store_file = CACHE_SETTINGS["store_file"]
+        store = None
+        if persist and store_file:
+            store = SqliteStore(store_file, f"v{CACHE_VERSION}:{namespace}")
+        _shared_caches[namespace] = LRUCache(namespace, maxsize, store, persist)
+    return _shared_caches[namespace]
+
+
+def cache_stats():
+    return {namespace: cache.stats() for (namespace, cache) in _shared_caches.items()}
+
+
+def flush_stores():
+    """Writes the pending entries of the on-disk stores of this process"""
+    for cache in _shared_caches.values():
+        if cache.store is not None:
+            cache.store.flush()
+
+
+def clear_caches():
+    for cache in _shared_caches.values():
+        cache.clear()
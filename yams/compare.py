@@ -0,0 +1,111 @@
+"""Paired agent comparison with common random numbers.
+Every agent plays each game on the same pre-drawn dice (yams.CommonDice), so
+score differences between agents are measured on paired games. Games are
+played by batches until the ranking is significant (or max_games is reached).
+The ranking is tested after every batch, so the confidence is split between
+the pairs and the looks (Bonferroni): stopping at the first significant look
+keeps the overall error rate below 1 - confidence.
+"""
+from itertools import combinations
+from statistics import NormalDist
+
+import numpy as np
+from yams import CommonDice, game_seeds, play_game
+
+
+def play_common_game(agents, seed):
+    """Scores of every agent on the same dice"""
+    return [play_game(agent, seed=CommonDice(seed)) for agent in agents]
+
+
+def paired_difference(scores_a, scores_b, z):
+    """Mean paired score difference and its confidence interval half width"""
+    differences = np.asarray(scores_a) - np.asarray(scores_b)
+    half_width = z * differences.std(ddof=1) / np.sqrt(len(differences))
+    return differences.mean(), half_width
+
+
+def n_looks(max_games, min_games, batch_size):
+    """Number of batches after which compare_agents can stop"""
+    batch_ends = [*range(batch_size, max_games, batch_size), max_games]
+    return max(sum(n_games >= min_games for n_games in batch_ends), 1)
+
+
+def compare_agents(
+    agents,
+    max_games=5000,
+    min_games=100,
+    batch_size=100,
+    confidence=0.95,
+    seed=None,
+    map_func=map,
+    verbose=True,
+):
+    """Ranks agents on paired games, stopping once every adjacent pair of the
+    ranking differs significantly (confidence corrected for the pairs and for
+    the looks at the ranking from min_games on, see n_looks).
+    `map_func(func, agents_list, seeds)` can be a parallel map such as p_map.
+    Returns a report dict: ranking, mean scores and pairwise differences.
+    """
+    names = [str(agent) for agent in agents]
+    n_pairs = max(len(agents) - 1, 1)
+    n_tests = n_pairs * n_looks(max_games, min_games, batch_size)
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * n_tests))
+
+    seeds = game_seeds(max_games, seed)
+    scores = np.zeros((0, len(agents)))
+    is_significant = False
+    while len(scores) < max_games:
+        batch_seeds = seeds[len(scores):len(scores) + batch_size]
+        batch_scores = list(map_func(
+            play_common_game, [agents] * len(batch_seeds), batch_seeds
+        ))
+        scores = np.concatenate((scores, batch_scores))
+
+        ranking = np.argsort(-scores.mean(axis=0), kind="stable")
+        adjacent_differences = [
+            paired_difference(scores[:, i], scores[:, j], z)
+            for (i, j) in zip(ranking[:-1], ranking[1:])
+        ]
+        is_significant = all(abs(mean) > half for (mean, half) in adjacent_differences)
+        if verbose:
+            print(
+                f"{len(scores)} games:",
+                " > ".join(f"{names[i]} ({scores[:, i].mean():.1f})" for i in ranking),
+            )
+        if is_significant and len(scores) >= min_games:
+            break
+
+    return {
+        "n_games": len(scores),
+        "confidence": confidence,
+        "z": z,
+        "is_significant": is_significant,
+        "ranking": [names[i] for i in ranking],
+        "mean_scores": dict(zip(names, scores.mean(axis=0).tolist())),
+        "differences": {
+            f"{names[i]} - {names[j]}": dict(zip(
+                ("mean", "half_width"), map(float, paired_difference(scores[:, i], scores[:, j], z))
+            ))
+            for (i, j) in combinations(range(len(agents)), 2)
+        },
+    }
+
+
+if __name__ == "__main__":
+    import json
+
+    from agents import YamsT1, YamsT1E, YamsT1T
+    from p_tqdm import p_map
+
+    report = compare_agents(
+        [
+            YamsT1(),
+            YamsT1E(),
+            YamsT1T(target_scores_file='target_full_custom.json'),
+            YamsT1T(target_scores_file='target_median_YamsT1E.json'),
+        ],
+        seed=0,
+        map_func=p_map,
+    )
+    print(json.dumps(report, indent=2))
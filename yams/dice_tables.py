@@ -0,0 +1,144 @@
+"""Precomputed dice tables.
+Kept dice multisets, the exact probability of each sorted throw
+(see yams.THROWS) reachable by rerolling the other dice, the keeps
+available from each throw and the throws each keep can be locked from.
+"""
+from collections import Counter
+from itertools import combinations_with_replacement
+from math import factorial, prod
+
+import numpy as np
+from yams import THROW_INDEX, THROWS
+
+# All kept dice multisets (0 to 5 dice), 462 of them
+KEEPS = [
+    keep
+    for n_dice in range(6)
+    for keep in combinations_with_replacement(range(1, 7), n_dice)
+]
+KEEP_INDEX = {keep: i for (i, keep) in enumerate(KEEPS)}
+EMPTY_KEEP = KEEP_INDEX[()]
+
+
+def reroll_probability(reroll):
+    """Probability of rolling this (sorted) multiset of dice"""
+    n_ways = factorial(len(reroll)) // prod(
+        factorial(n) for n in Counter(reroll).values()
+    )
+    return n_ways / 6 ** len(reroll)
+
+
+def _sparse_transitions():
+    """CSR-like arrays: outcomes of keep i are OUTCOMES[PTR[i]:PTR[i + 1]]"""
+    ptr, outcomes, probs = [0], [], []
+    for keep in KEEPS:
+        for reroll in combinations_with_replacement(range(1, 7), 5 - len(keep)):
+            outcomes.append(THROW_INDEX[tuple(sorted(keep + reroll))])
+            probs.append(reroll_probability(reroll))
+        ptr.append(len(outcomes))
+    return np.array(ptr), np.array(outcomes), np.array(probs)
+
+
+KEEP_PTR, KEEP_OUTCOMES, KEEP_PROBS = _sparse_transitions()
+for _array in (KEEP_PTR, KEEP_OUTCOMES, KEEP_PROBS):
+    _array.setflags(write=False)
+
+# Dense (462, 252) version, for matrix products over every keep at once
+TRANSITIONS = np.zeros((len(KEEPS), len(THROWS)))
+TRANSITIONS[
+    np.repeat(np.arange(len(KEEPS)), np.diff(KEEP_PTR)), KEEP_OUTCOMES
+] = KEEP_PROBS
+TRANSITIONS.setflags(write=False)
+
+
+# Dice counts (of faces 1 to 6) of each throw and keep, and number of rerolled dice
+THROW_COUNTS = np.array([[throw.count(face) for face in range(1, 7)] for throw in THROWS])
+KEEP_COUNTS = np.array([[keep.count(face) for face in range(1, 7)] for keep in KEEPS])
+KEEP_N_REROLLS = 5 - KEEP_COUNTS.sum(axis=1)
+# Throw index of dice counts, through their base 6 code (counts @ COUNTS_BASE)
+COUNTS_BASE = 6 ** np.arange(6)
+COUNTS_THROW = np.full(6 ** 6, -1)
+COUNTS_THROW[THROW_COUNTS @ COUNTS_BASE] = np.arange(len(THROWS))
+for _array in (THROW_COUNTS, KEEP_COUNTS, KEEP_N_REROLLS, COUNTS_THROW):
+    _array.setflags(write=False)
+
+
+def keep_transitions(keep):
+    """Reachable throw indices and their probabilities from a kept dice tuple"""
+    i_keep = KEEP_INDEX[tuple(sorted(keep))]
+    start, end = KEEP_PTR[i_keep], KEEP_PTR[i_keep + 1]
+    return KEEP_OUTCOMES[start:end], KEEP_PROBS[start:end]
+
+
+def _throw_keeps():
+    """Indices of the distinct keeps available from each throw (sorted),
+    padded to 32 columns by repeating the first one, and their number"""
+    throw_keeps = np.zeros((len(THROWS), 32), dtype=np.int16)
+    n_keeps = np.zeros(len(THROWS), dtype=np.int8)
+    for i_throw, throw in enumerate(THROWS):
+        keeps = {
+            tuple(throw[j] for j in range(5) if i & (1 << j)) for i in range(32)
+        }
+        keeps = sorted(KEEP_INDEX[keep] for keep in keeps)
+        throw_keeps[i_throw] = keeps + keeps[:1] * (32 - len(keeps))
+        n_keeps[i_throw] = len(keeps)
+    return throw_keeps, n_keeps
+
+
+THROW_KEEPS, THROW_N_KEEPS = _throw_keeps()
+THROW_KEEPS.setflags(write=False)
+THROW_N_KEEPS.setflags(write=False)
+# Kept dice tuples of each throw, in THROW_KEEPS order
+THROW_LOCKS = [
+    [KEEPS[keep] for keep in THROW_KEEPS[i_throw, :n_keeps]]
+    for (i_throw, n_keeps) in enumerate(THROW_N_KEEPS.tolist())
+]
+
+
+def _keep_parents():
+    """CSR-like arrays: throws containing keep i are PARENTS[PTR[i]:PTR[i + 1]]"""
+    parents = [[] for _ in KEEPS]
+    for i_throw in range(len(THROWS)):
+        for keep in THROW_KEEPS[i_throw, :THROW_N_KEEPS[i_throw]].tolist():
+            parents[keep].append(i_throw)
+    ptr = np.cumsum([0] + [len(throws) for throws in parents])
+    return ptr.astype(np.int16), np.concatenate(parents).astype(np.int16)
+
+
+KEEP_PARENT_PTR, KEEP_PARENTS = _keep_parents()
+KEEP_PARENT_PTR.setflags(write=False)
+KEEP_PARENTS.setflags(write=False)
+
+
+def throw_locks(throw_idx):
+    """Distinct kept dice tuples of a throw index (shared list, not to be modified)"""
+    return THROW_LOCKS[throw_idx]
+
+
+def keep_parents(keep):
+    """Throw indices from which a kept dice tuple can be locked"""
+    i_keep = KEEP_INDEX[tuple(sorted(keep))]
+    return KEEP_PARENTS[KEEP_PARENT_PTR[i_keep]:KEEP_PARENT_PTR[i_keep + 1]]
+
+
+def aggregate_keeps(throw_values, keeps=slice(None), aggregate="mean"):
+    """Aggregate of the throw values reachable from each keep (keep indices).
+    `throw_values` is a (252,) array, or (n, 252) for n sets of values.
+    `aggregate` is "mean" (expectation), "median" or a quantile in [0, 1],
+    quantiles being weighted by the throws probabilities.
+    Means are rounded to 10 decimals, so that equal means summed in another
+    order (single or batched decisions) still tie.
+    """
+    transitions = TRANSITIONS[keeps]
+    if aggregate == "mean":
+        return np.round(throw_values @ transitions.T, 10)
+    if throw_values.ndim == 2:
+        return np.array([
+            aggregate_keeps(values, keeps, aggregate) for values in throw_values
+        ])
+    quantile = 0.5 if aggregate == "median" else aggregate
+    order = np.argsort(throw_values, kind="stable")
+    cumulated_probs = transitions[:, order].cumsum(axis=-1)
+    # First sorted throw where the cumulated probability reaches the quantile
+    i_quantile = (cumulated_probs < quantile - 1e-12).sum(axis=-1)
+    return throw_values[order[i_quantile]]
@@ -0,0 +1,174 @@
+"""Streaming agent evaluation.
+Games are played by chunks and folded into online statistics as soon as they
+complete: running mean and variance, score quantiles and per-row statistics.
+A checkpoint file lets an interrupted run resume where it stopped.
+"""
+import json
+import os
+from functools import partial
+
+import numpy as np
+from results import ResultStore, play_games_to_store, play_sheets
+from yams import SHEET_KEYS, SHEET_POSSIBLE_VALUES, game_seeds
+
+MAX_ROW_POINTS = max(max(values) for values in SHEET_POSSIBLE_VALUES.values())
+MAX_SCORE = sum(max(values) for values in SHEET_POSSIBLE_VALUES.values())
+
+
+class ScoreStats:
+    """Online statistics of final sheets.
+    Scores and row points are small integers, so their exact counts are the
+    quantile sketch: fixed memory, exact quantiles, and mergeable.
+    """
+
+    def __init__(self):
+        self.n_games = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared deviations to the mean (Welford)
+        self.score_counts = np.zeros(MAX_SCORE + 1, dtype=np.int64)
+        self.row_counts = np.zeros((len(SHEET_KEYS), MAX_ROW_POINTS + 1), dtype=np.int64)
+
+    def _merge_moments(self, n_games, mean, m2):
+        n_total = self.n_games + n_games
+        delta = mean - self.mean
+        self.m2 += m2 + delta**2 * self.n_games * n_games / n_total
+        self.mean += delta * n_games / n_total
+        self.n_games = n_total
+
+    def update(self, sheets):
+        """Adds final sheets, a (n, 14) array in SHEET_KEYS order"""
+        sheets = np.asarray(sheets, dtype=np.int64).reshape(-1, len(SHEET_KEYS))
+        if len(sheets) == 0:
+            return self
+        scores = sheets.sum(axis=1)
+        self._merge_moments(len(scores), scores.mean(), ((scores - scores.mean()) ** 2).sum())
+        self.score_counts += np.bincount(scores, minlength=MAX_SCORE + 1)
+        for i in range(len(SHEET_KEYS)):
+            self.row_counts[i] += np.bincount(sheets[:, i], minlength=MAX_ROW_POINTS + 1)
+        return self
+
+    def merge(self, other):
+        if other.n_games:
+            self._merge_moments(other.n_games, other.mean, other.m2)
+            self.score_counts += other.score_counts
+            self.row_counts += other.row_counts
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n_games - 1) if self.n_games > 1 else float("nan")
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def quantile(self, q):
+        """Lowest score whose cumulated frequency reaches q"""
+        cumulated_counts = self.score_counts.cumsum()
+        return int(np.searchsorted(cumulated_counts, max(q * self.n_games, 1)))
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def row_means(self):
+        return self.row_counts @ np.arange(MAX_ROW_POINTS + 1) / max(self.n_games, 1)
+
+    def row_scored_rates(self):
+        """Fraction of games where each row was scored (not scratched with 0)"""
+        return 1 - self.row_counts[:, 0] / max(self.n_games, 1)
+
+    def summary(self):
+        return {
+            "n_games": self.n_games,
+            "mean": float(self.mean),
+            "std": float(self.std),
+            "quantiles": {str(q): self.quantile(q) for q in (0.05, 0.25, 0.5, 0.75, 0.95)},
+            "row_means": dict(zip(map(str, SHEET_KEYS), self.row_means().tolist())),
+            "row_scored_rates": dict(zip(map(str, SHEET_KEYS), self.row_scored_rates().tolist())),
+        }
+
+    def to_dict(self):
+        return {
+            "n_games": self.n_games,
+            "mean": float(self.mean),
+            "m2": float(self.m2),
+            "score_counts": self.score_counts.tolist(),
+            "row_counts": self.row_counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.n_games = data["n_games"]
+        stats.mean = data["mean"]
+        stats.m2 = data["m2"]
+        stats.score_counts[:] = data["score_counts"]
+        stats.row_counts[:] = data["row_counts"]
+        return stats
+
+
+def save_checkpoint(checkpoint_file, agent, seed, stats):
+    """Writes the checkpoint atomically, so an interruption never corrupts it"""
+    os.makedirs(os.path.dirname(checkpoint_file) or ".", exist_ok=True)
+    with open(checkpoint_file + ".tmp", "w") as file:
+        json.dump({"agent": str(agent), "seed": seed, "stats": stats.to_dict()}, file)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file, agent, seed):
+    """Statistics of a previous run of the same agent and seed, None if there is none"""
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file) as file:
+        checkpoint = json.load(file)
+    if checkpoint["agent"] != str(agent) or checkpoint["seed"] != seed:
+        raise ValueError(
+            f"{checkpoint_file} is a checkpoint of {checkpoint['agent']} "
+            f"with seed {checkpoint['seed']}, not of {agent} with seed {seed}"
+        )
+    return ScoreStats.from_dict(checkpoint["stats"])
+
+
+def evaluate_agent(
+    agent,
+    n_games,
+    seed=0,
+    chunk_size=100,
+    checkpoint_file=None,
+    store_file=None,
+    map_func=map,
+):
+    """Plays n_games by chunks, yielding the updated ScoreStats after each chunk.
+    Game i always uses the i-th seed of game_seeds(..., seed), so a run resumed
+    from `checkpoint_file` plays the same games as an uninterrupted one.
+    Sheets are appended to the ResultStore `store_file` if given, by the
+    process playing their chunk. When the checkpoint already covers n_games,
+    its ScoreStats are yielded once.
+    `map_func(func, agents, seeds_chunks[, first_games])` must be lazy (e.g.
+    Pool.imap) for results to stream in as chunks complete.
+    """
+    stats = load_checkpoint(checkpoint_file, agent, seed) or ScoreStats()
+    store = ResultStore(store_file) if store_file is not None else None
+    store_seed = -1 if seed is None else seed
+    if store is not None:
+        # Games played after the last checkpoint are played again
+        store.clear(agent, seed=store_seed, from_game=stats.n_games)
+
+    seeds = game_seeds(n_games, seed)
+    chunk_starts = range(stats.n_games, n_games, chunk_size)
+    if not chunk_starts:
+        yield stats
+        return
+    chunk_agents = [agent] * len(chunk_starts)
+    seeds_chunks = [seeds[i:i + chunk_size] for i in chunk_starts]
+    if store is None:
+        chunks = map_func(play_sheets, chunk_agents, seeds_chunks)
+    else:
+        play_chunk = partial(play_games_to_store, store_file=store_file, root_seed=store_seed)
+        chunks = map_func(play_chunk, chunk_agents, seeds_chunks, chunk_starts)
+    for sheets, _ in chunks:
+        stats.update(sheets)
+        if checkpoint_file is not None:
+            save_checkpoint(checkpoint_file, agent, seed, stats)
+        yield stats
@@ -0,0 +1,187 @@
+"""Exact evaluation of deterministic agents.
+Instead of sampling games, the probability mass of the sheet states is
+propagated turn by turn: each distinct compact state of a turn is decided
+once (through the batched decision API) for all the throws of the turn, and
+carries the distribution of the points scored so far. Games end with the exact
+score distribution, mean and per-row points distributions.
+"""
+import numpy as np
+from dice_tables import EMPTY_KEEP, KEEPS, TRANSITIONS
+from evaluation import MAX_ROW_POINTS, MAX_SCORE
+from yams import (
+    BALANCE_SHIFT,
+    BONUS_POINTS,
+    BONUS_THRESHOLD,
+    EMPTY_STATE,
+    POINTS_TABLE,
+    ROWS_MASK,
+    SHEET_KEYS,
+    THROWS,
+    fill_rows,
+)
+
+BONUS_COLUMN = SHEET_KEYS.index("Bonus")
+MAX_TURN_POINTS = MAX_ROW_POINTS + BONUS_POINTS
+
+
+class ScoreDistribution:
+    """Exact distribution of the final sheets, with the statistics of
+    evaluation.ScoreStats (probabilities instead of counts)"""
+
+    def __init__(self, score_probs, row_probs, n_states=0):
+        self.score_probs = np.asarray(score_probs, dtype=np.float64)
+        self.row_probs = np.asarray(row_probs, dtype=np.float64)
+        self.n_states = n_states  # Distinct states evaluated
+
+    @property
+    def mean(self):
+        return float(self.score_probs @ np.arange(len(self.score_probs)))
+
+    @property
+    def variance(self):
+        scores = np.arange(len(self.score_probs))
+        return float(self.score_probs @ (scores - self.mean) ** 2)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def quantile(self, q):
+        """Lowest score whose cumulated probability reaches q"""
+        return int(np.searchsorted(self.score_probs.cumsum(), q - 1e-12))
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def row_means(self):
+        return self.row_probs @ np.arange(MAX_ROW_POINTS + 1)
+
+    def row_scored_rates(self):
+        """Probability of each row being scored (not scratched with 0)"""
+        return 1 - self.row_probs[:, 0]
+
+    def summary(self):
+        return {
+            "n_states": self.n_states,
+            "mean": self.mean,
+            "std": float(self.std),
+            "quantiles": {str(q): self.quantile(q) for q in (0.05, 0.25, 0.5, 0.75, 0.95)},
+            "row_means": dict(zip(map(str, SHEET_KEYS), self.row_means().tolist())),
+            "row_scored_rates": dict(zip(map(str, SHEET_KEYS), self.row_scored_rates().tolist())),
+        }
+
+
+def turn_outcomes(agent, states):
+    """Final throw probabilities and chosen rows (SHEET_KEYS indices) of a turn
+    played by the agent from each state, as (n_states, 252) arrays"""
+    n_states, n_throws = len(states), len(THROWS)
+    batch_states = np.repeat(states, n_throws)
+    batch_throws = np.tile(np.arange(n_throws), n_states)
+    # Throws reach keeps, merged per state before rerolling
+    keep_offsets = np.repeat(np.arange(n_states) * len(KEEPS), n_throws)
+    probs = np.tile(TRANSITIONS[EMPTY_KEEP], (n_states, 1))
+    for is_first_lock in (True, False):
+        keeps = agent.lock_dice_many(batch_states, batch_throws, is_first_lock)
+        keep_probs = np.bincount(
+            keep_offsets + keeps, probs.ravel(), minlength=n_states * len(KEEPS)
+        )
+        probs = keep_probs.reshape(n_states, len(KEEPS)) @ TRANSITIONS
+    rows = agent.choose_row_many(batch_states, batch_throws).reshape(n_states, n_throws)
+    return probs, rows
+
+
+def _play_turn(agent, states, score_probs, row_probs):
+    """Next states of a chunk of states and their (n_next, width) score
+    probabilities, adding the rows points distribution to row_probs"""
+    n_states, width = score_probs.shape
+    probs, rows = turn_outcomes(agent, states)
+    points = POINTS_TABLE[np.arange(len(THROWS)), rows]
+
+    # Outcomes of a turn: distinct (state, row, points)
+    keys = np.arange(n_states)[:, None] * len(SHEET_KEYS) + rows
+    keys = keys * (MAX_ROW_POINTS + 1) + points
+    keys, inverse = np.unique(keys.ravel(), return_inverse=True)
+    outcome_probs = np.bincount(inverse.ravel(), probs.ravel())
+    i_states = keys // ((MAX_ROW_POINTS + 1) * len(SHEET_KEYS))
+    rows = keys // (MAX_ROW_POINTS + 1) % len(SHEET_KEYS)
+    points = keys % (MAX_ROW_POINTS + 1)
+    next_states, bonus = fill_rows(states[i_states], rows, points)
+
+    state_probs = score_probs.sum(axis=1)
+    is_row = rows != BONUS_COLUMN  # Bonus row points are counted once the game ends
+    np.add.at(
+        row_probs,
+        (rows[is_row], points[is_row]),
+        (outcome_probs * state_probs[i_states])[is_row],
+    )
+
+    # Score probabilities of each next state, shifted by the points won
+    next_states, i_next = np.unique(next_states, return_inverse=True)
+    next_width = width + MAX_TURN_POINTS
+    columns = (
+        (i_next.ravel() * next_width + points + bonus)[:, None] + np.arange(width)
+    ).ravel()
+    weights = (outcome_probs[:, None] * score_probs[i_states]).ravel()
+    next_probs = np.bincount(columns, weights, minlength=len(next_states) * next_width)
+    return next_states, next_probs.reshape(len(next_states), next_width)
+
+
+def _merge_states(states, score_probs):
+    """Distinct states and the sum of their score probabilities"""
+    order = np.argsort(states, kind="stable")
+    states, score_probs = states[order], score_probs[order]
+    starts = np.flatnonzero(np.diff(states, prepend=-1))
+    return states[starts], np.add.reduceat(score_probs, starts, axis=0)
+
+
+def evaluate_policy(agent, chunk_size=256, verbose=False):
+    """Exact ScoreDistribution of the games of a deterministic agent.
+    The work grows with the number of distinct states the agent visits
+    (~100k for YamsT1), decided chunk_size states at a time.
+    """
+    if not agent.is_deterministic:
+        raise ValueError(f"{agent} is not deterministic, its games can only be sampled")
+    final_probs = np.zeros(MAX_SCORE + 1)
+    row_probs = np.zeros((len(SHEET_KEYS), MAX_ROW_POINTS + 1))
+    states, score_probs = np.array([EMPTY_STATE]), np.ones((1, 1))
+    n_states, turn = 0, 0
+    while len(states):
+        n_states += len(states)
+        turn += 1
+        chunks = [
+            _play_turn(agent, states[i:i + chunk_size], score_probs[i:i + chunk_size], row_probs)
+            for i in range(0, len(states), chunk_size)
+        ]
+        width = max(chunk_probs.shape[1] for (_, chunk_probs) in chunks)
+        states, score_probs = _merge_states(
+            np.concatenate([chunk_states for (chunk_states, _) in chunks]),
+            np.concatenate([
+                np.pad(chunk_probs, ((0, 0), (0, width - chunk_probs.shape[1])))
+                for (_, chunk_probs) in chunks
+            ]),
+        )
+        # Drop the columns of scores out of reach
+        score_probs = score_probs[:, :np.flatnonzero(score_probs.any(axis=0)).max() + 1]
+
+        is_final = states & ROWS_MASK == ROWS_MASK
+        final_scores = score_probs[is_final].sum(axis=0)
+        final_probs[:len(final_scores)] += final_scores
+        has_bonus = states[is_final] >> BALANCE_SHIFT >= BONUS_THRESHOLD
+        game_probs = score_probs[is_final].sum(axis=1)
+        row_probs[BONUS_COLUMN, BONUS_POINTS] += game_probs[has_bonus].sum()
+        row_probs[BONUS_COLUMN, 0] += game_probs[~has_bonus].sum()
+        states, score_probs = states[~is_final], score_probs[~is_final]
+        if verbose:
+            print(f"Turn {turn}: {len(states)} states, {final_probs.sum():.4f} of games ended")
+    return ScoreDistribution(final_probs, row_probs, n_states)
+
+
+if __name__ == "__main__":
+    import json
+
+    from agents import YamsT1, YamsT1E, YamsT1T
+
+    for agent in (YamsT1(), YamsT1E(), YamsT1T()):
+        distribution = evaluate_policy(agent, verbose=True)
+        print(agent, json.dumps(distribution.summary(), indent=2))
@@ -0,0 +1,147 @@
+"""Run-time instrumentation, off unless enabled.
+Timers count the calls and time of instrumented functions (see instrumented)
+and of agent decisions and games (see timed_call), with a log2 histogram of
+the durations in microseconds. Reports are plain dicts, so worker processes
+can send theirs to be merged (see merge_reports) and dumped as JSON.
+"""
+import os
+from functools import wraps
+from time import perf_counter
+
+from caches import cache_stats
+
+SETTINGS = {"enabled": False}
+N_BUCKETS = 40  # Bucket i counts durations in [2**(i-1), 2**i) microseconds
+_timers = {}
+_cache_snapshot = {}
+
+
+def enable(enabled=True):
+    """Switches profiling on (timers and cache counters starting from zero) or off"""
+    if enabled and not SETTINGS["enabled"]:
+        take_report(reset=True)
+    SETTINGS["enabled"] = enabled
+
+
+def is_enabled():
+    return SETTINGS["enabled"]
+
+
+def record(name, seconds, timers=None):
+    """Adds a duration to the timer `name` (of the process timers by default)"""
+    timers = _timers if timers is None else timers
+    timer = timers.get(name)
+    if timer is None:
+        timer = timers[name] = {
+            "calls": 0, "total_s": 0.0, "max_s": 0.0, "buckets": [0] * N_BUCKETS
+        }
+    timer["calls"] += 1
+    timer["total_s"] += seconds
+    timer["max_s"] = max(timer["max_s"], seconds)
+    timer["buckets"][min(int(seconds * 1e6).bit_length(), N_BUCKETS - 1)] += 1
+
+
+def instrumented(func):
+    """Decorator timing every call of func when profiling is enabled"""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not SETTINGS["enabled"]:
+            return func(*args, **kwargs)
+        t0 = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, perf_counter() - t0)
+
+    return wrapper
+
+
+def timed_call(scope, name, func, *args, **kwargs):
+    """func(*args, **kwargs), timed as "{scope}.{name}" when profiling is enabled
+    (scope is typically the agent)"""
+    if not SETTINGS["enabled"]:
+        return func(*args, **kwargs)
+    t0 = perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        record(f"{scope}.{name}", perf_counter() - t0)
+
+
+def take_report(reset=True):
+    """Timers and cache statistics of this process since the last reset"""
+    caches = {}
+    for namespace, stats in cache_stats().items():
+        last = _cache_snapshot.get(namespace, {})
+        caches[namespace] = {
+            k: stats[k] - last.get(k, 0) for k in ("hits", "misses", "evictions")
+        }
+        caches[namespace]["size"] = stats["size"]
+    report = {
+        "pids": [os.getpid()],
+        "timers": {
+            name: {**timer, "buckets": list(timer["buckets"])}
+            for (name, timer) in _timers.items()
+        },
+        "caches": caches,
+    }
+    if reset:
+        _timers.clear()
+        _cache_snapshot.update(cache_stats())
+    return report
+
+
+def merge_reports(reports):
+    """Sum of the reports of several processes (or chunks)"""
+    merged = {"pids": [], "timers": {}, "caches": {}}
+    for report in reports:
+        merged["pids"] = sorted(set(merged["pids"]) | set(report["pids"]))
+        for name, timer in report["timers"].items():
+            total = merged["timers"].setdefault(
+                name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "buckets": [0] * N_BUCKETS}
+            )
+            total["calls"] += timer["calls"]
+            total["total_s"] += timer["total_s"]
+            total["max_s"] = max(total["max_s"], timer["max_s"])
+            total["buckets"] = [a + b for (a, b) in zip(total["buckets"], timer["buckets"])]
+        for namespace, stats in report["caches"].items():
+            total = merged["caches"].setdefault(
+                namespace, {"hits": 0, "misses": 0, "evictions": 0, "size": 0}
+            )
+            for k in ("hits", "misses", "evictions"):
+                total[k] += stats[k]
+            # Caches are per process: sizes are only indicative
+            total["size"] = max(total["size"], stats["size"])
+    return merged
+
+
+def bucket_quantile(buckets, q):
+    """Upper bound (seconds) of the histogram bucket holding the q quantile"""
+    n_calls = sum(buckets)
+    cumulated = 0
+    for i, count in enumerate(buckets):
+        cumulated += count
+        if cumulated >= q * n_calls:
+            return (1 << i) * 1e-6
+    return float("inf")
+
+
+def summarize(report):
+    """Report with per timer mean and approximate quantiles, and cache hit rates"""
+    timers = {}
+    for name, timer in sorted(report["timers"].items(), key=lambda item: -item[1]["total_s"]):
+        timers[name] = {
+            "calls": timer["calls"],
+            "total_s": timer["total_s"],
+            "mean_s": timer["total_s"] / timer["calls"],
+            "p50_s": bucket_quantile(timer["buckets"], 0.5),
+            "p99_s": bucket_quantile(timer["buckets"], 0.99),
+            "max_s": timer["max_s"],
+        }
+    caches = {}
+    for namespace, stats in report["caches"].items():
+        n_lookups = stats["hits"] + stats["misses"]
+        caches[namespace] = {**stats, "hit_rate": stats["hits"] / n_lookups if n_lookups else 0.0}
+    return {"n_processes": len(report["pids"]), "timers": timers, "caches": caches}
@@ -0,0 +1,164 @@
+"""Columnar store of simulated games.
+One fixed-width record per game (the sheet rows, agent, seed and timing),
+appended in chunks to a flat binary file and read back memory-mapped.
+"""
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+from yams import SHEET_KEYS, CommonDice, play_game
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not locked
+    fcntl = None
+
+SHEET_COLUMNS = [str(k) for k in SHEET_KEYS]
+RESULT_DTYPE = np.dtype(
+    [(column, np.int8) for column in SHEET_COLUMNS]
+    + [
+        ("agent", "S48"),  # str(agent)
+        ("seed", np.int64),  # root seed of the run, -1 if unseeded
+        ("game", np.int64),  # game index in the run (seed spawn key)
+        ("duration", np.float32),  # wall time of the game, in seconds
+    ]
+)
+
+
+def make_records(sheets, agent, seed=-1, games=None, durations=None):
+    """Records of finished sheets, given as dicts or as a (n, 14) array"""
+    if len(sheets) and isinstance(sheets[0], dict):
+        sheets = [[sheet[k] for k in SHEET_KEYS] for sheet in sheets]
+    sheets = np.asarray(sheets).reshape(-1, len(SHEET_KEYS))
+    records = np.zeros(len(sheets), dtype=RESULT_DTYPE)
+    for i, column in enumerate(SHEET_COLUMNS):
+        records[column] = sheets[:, i]
+    records["agent"] = str(agent)
+    records["seed"] = seed
+    records["game"] = np.arange(len(sheets)) if games is None else games
+    records["duration"] = np.nan if durations is None else durations
+    return records
+
+
+class ResultStore:
+    """Appendable file of RESULT_DTYPE records.
+    Each append is one write under the lock of a separate `.lock` file, so
+    worker processes can add their chunks to the same file concurrently, and
+    clear can replace the file without losing their records.
+    """
+
+    def __init__(self, filename="data/results.bin"):
+        self.filename = filename
+
+    @contextmanager
+    def locked(self):
+        """Exclusive access to the store file, across processes"""
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with open(self.filename + ".lock", "ab") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, records):
+        records = np.asarray(records, dtype=RESULT_DTYPE)
+        # Opened under the lock: the file may have been replaced by clear
+        with self.locked(), open(self.filename, "ab") as file:
+            file.write(records.tobytes())
+            file.flush()
+
+    def append_sheets(self, sheets, agent, seed=-1, games=None, durations=None):
+        self.append(make_records(sheets, agent, seed, games, durations))
+
+    def __len__(self):
+        if not os.path.exists(self.filename):
+            return 0
+        return os.path.getsize(self.filename) // RESULT_DTYPE.itemsize
+
+    def read(self):
+        """Memory-mapped records (complete ones only)"""
+        n_records = len(self)
+        if n_records == 0:
+            return np.zeros(0, dtype=RESULT_DTYPE)
+        return np.memmap(self.filename, dtype=RESULT_DTYPE, mode="r", shape=(n_records,))
+
+    def to_dataframe(self, agents=None):
+        """Sheets as a pandas DataFrame, with an agent column and a Score column"""
+        import pandas as pd
+
+        records = self.read()
+        if agents is not None:
+            records = records[np.isin(records["agent"], [str(a).encode() for a in agents])]
+        sheets_df = pd.DataFrame({column: records[column] for column in SHEET_COLUMNS})
+        sheets_df["agent"] = np.char.decode(records["agent"]).astype(object)
+        for column in ("seed", "game", "duration"):
+            sheets_df[column] = records[column]
+        sheets_df["Score"] = sum(records[column].astype(np.int64) for column in SHEET_COLUMNS)
+        return sheets_df
+
+    def clear(self, agent=None, seed=None, from_game=0):
+        """Remove the records of an agent (all records if None), only those of
+        a run's seed and its games from `from_game` on if given.
+        The kept records are written to a temporary file replacing the store,
+        so an interrupted clear leaves the store as it was."""
+        with self.locked():
+            if not os.path.exists(self.filename):
+                return
+            if agent is None:
+                os.remove(self.filename)
+                return
+            with open(self.filename, "rb") as file:
+                records = np.frombuffer(file.read(), dtype=RESULT_DTYPE, count=len(self))
+            dropped = (records["agent"] == str(agent).encode()) & (records["game"] >= from_game)
+            if seed is not None:
+                dropped &= records["seed"] == seed
+            if dropped.any():
+                with open(self.filename + ".tmp", "wb") as tmp_file:
+                    tmp_file.write(records[~dropped].tobytes())
+                os.replace(self.filename + ".tmp", self.filename)
+
+
+def import_json_sheets(sheets_dir, store_file, agent=None):
+    """Append the sheet_*.json files of a directory (former data/sheets/{agent}/ layout)"""
+    import json
+    from glob import glob
+
+    sheet_files = sorted(glob(os.path.join(sheets_dir, "sheet_*.json")))
+    sheets = []
+    for filename in sheet_files:
+        with open(filename) as file:
+            sheets.append(json.load(file))
+    if agent is None:
+        agent = os.path.basename(os.path.normpath(sheets_dir))
+    sheets = [[sheet[column] for column in SHEET_COLUMNS] for sheet in sheets]
+    ResultStore(store_file).append_sheets(sheets, agent)
+    return len(sheets)
+
+
+def play_sheets(agent, seeds, common_dice=False):
+    """Final sheets (n, 14) int8 of one game per seed, and the wall time of each game.
+    With common_dice, each game is played on yams.CommonDice(seed)."""
+    sheets, durations = [], []
+    for seed in seeds:
+        if common_dice:
+            seed = CommonDice(seed)
+        t0 = perf_counter()
+        sheet = play_game(agent, return_sheet=True, seed=seed)
+        durations.append(perf_counter() - t0)
+        sheets.append([sheet[k] for k in SHEET_KEYS])
+    sheets = np.array(sheets, dtype=np.int8).reshape(-1, len(SHEET_KEYS))
+    return sheets, np.array(durations, dtype=np.float32)
+
+
+def play_games_to_store(agent, seeds, first_game, store_file, root_seed=-1):
+    """play_sheets, appending the games to the store as a single chunk, so
+    worker processes write their own chunks. Returns the sheets and durations.
+    """
+    sheets, durations = play_sheets(agent, seeds)
+    games = np.arange(first_game, first_game + len(sheets))
+    ResultStore(store_file).append_sheets(sheets, agent, root_seed, games, durations)
+    return sheets, durations
@@ -0,0 +1,145 @@
+"""Process pool game runner.
+Agents are sent to each worker once, when the pool starts (as a spec, i.e.
+their class and get_config(), or pickled), instead of once per game. Tasks
+are chunks of games returning compact arrays, and the workers pull them from
+a shared queue, so the chunks of several agents balance across the pool.
+"""
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from caches import flush_stores
+from profiling import enable, is_enabled, merge_reports, take_report
+from results import play_sheets
+from yams import SHEET_KEYS, game_seeds
+
+_worker_agents = []
+
+
+def agent_spec(agent):
+    """Class and constructor arguments rebuilding an equivalent agent"""
+    return agent.__class__, agent.get_config()
+
+
+def build_agent(spec):
+    agent_class, config = spec
+    return agent_class(**config)
+
+
+def _init_worker(agents, use_specs, profile):
+    global _worker_agents
+    _worker_agents = [build_agent(agent) if use_specs else agent for agent in agents]
+    enable(profile)
+
+
+def _worker_report():
+    """Profiling report of the task just done, None if profiling is off.
+    Flushes the cache stores too: workers exit without running atexit."""
+    flush_stores()
+    return take_report() if is_enabled() else None
+
+
+def _call_with_agent(task):
+    """Worker side: func(worker's agent, *args)"""
+    func, i_agent, args = task
+    return func(_worker_agents[i_agent], *args), _worker_report()
+
+
+def _play_chunk(task):
+    i_agent, first_game, seeds, common_dice = task
+    sheets, durations = play_sheets(_worker_agents[i_agent], seeds, common_dice)
+    return (i_agent, first_game, sheets, durations), _worker_report()
+
+
+class GameRunner:
+    """Pool of `processes` workers, each holding its own copy of the agents.
+    With use_specs, workers build their agents from agent_spec(agent), so
+    nothing but the class and config is pickled (not even cache contents).
+    With profile, workers are profiled (see profiling.py) and their reports
+    merged into profile_report().
+    Use as a context manager, or call close().
+    """
+
+    def __init__(self, agents, processes=None, chunk_size=100, use_specs=True, profile=False):
+        self.agents = list(agents)
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.reports = []
+        shipped = [agent_spec(agent) for agent in self.agents] if use_specs else self.agents
+        self.pool = Pool(
+            self.processes, initializer=_init_worker, initargs=(shipped, use_specs, profile)
+        )
+
+    def _collect(self, results):
+        for result, report in results:
+            if report is not None:
+                self.reports.append(report)
+            yield result
+
+    def profile_report(self):
+        """Profiling report merged over every task done so far"""
+        self.reports = [merge_reports(self.reports)]
+        return self.reports[0]
+
+    def agent_index(self, agent):
+        for i, runner_agent in enumerate(self.agents):
+            if runner_agent is agent:
+                return i
+        raise ValueError(f"{agent} is not an agent of this runner")
+
+    def imap(self, func, agents, *iterables):
+        """Lazy, ordered map of func(agent, *args), called in the workers with
+        their own copy of each agent (which must be one of the runner's agents).
+        Drop-in `map_func` of evaluation.evaluate_agent.
+        """
+        tasks = (
+            (func, self.agent_index(agent), args)
+            for (agent, *args) in zip(agents, *iterables)
+        )
+        return self._collect(self.pool.imap(_call_with_agent, tasks))
+
+    def run(self, n_games, seed=0, common_dice=False):
+        """Plays n_games (int, or a list with one value per agent) with every
+        agent, on the same game seeds. With common_dice, the agents also share
+        the dice of each game (see yams.CommonDice) and not only its seed.
+        Chunks of all agents are interleaved in a single queue and yielded as
+        they complete, in any order, as
+        (agent index, index of the first game, sheets (n, 14) int8, durations).
+        """
+        if np.ndim(n_games) == 0:
+            n_games = [n_games] * len(self.agents)
+        seeds = game_seeds(max(n_games), seed)
+        tasks = [
+            (i_agent, start, seeds[start:start + self.chunk_size])
+            for start in range(0, max(n_games), self.chunk_size)
+            for i_agent in range(len(self.agents))
+            if start < n_games[i_agent]
+        ]
+        # Trim the last chunk of agents playing fewer games
+        tasks = [
+            (i_agent, start, chunk[:n_games[i_agent] - start], common_dice)
+            for (i_agent, start, chunk) in tasks
+        ]
+        return self._collect(self.pool.imap_unordered(_play_chunk, tasks))
+
+    def play(self, n_games, seed=0, common_dice=False):
+        """Final sheets of every agent, as a list of (n_games, 14) arrays in game order"""
+        if np.ndim(n_games) == 0:
+            n_games = [n_games] * len(self.agents)
+        sheets = [np.zeros((n, len(SHEET_KEYS)), dtype=np.int8) for n in n_games]
+        for i_agent, start, chunk_sheets, _ in self.run(n_games, seed, common_dice):
+            sheets[i_agent][start:start + len(chunk_sheets)] = chunk_sheets
+        return sheets
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.pool.terminate()
@@ -0,0 +1,117 @@
+"""Depth 2 expectimax search of a turn's two rerolls.
+From one scoring state, leaves are the agent's scores of the 252 final
+throws. Chance nodes are keeps (kept dice multisets), valued by aggregating
+the throws they reach; decision nodes are the throws after the first reroll,
+valued by their best keep. Both are memoized per search, so sibling branches
+reaching the same keep or throw share one evaluation, and a search can be kept
+for every decision of its scoring state.
+"""
+from time import perf_counter
+
+import numpy as np
+from dice_tables import (
+    KEEP_OUTCOMES,
+    KEEP_PROBS,
+    KEEP_PTR,
+    KEEPS,
+    THROW_KEEPS,
+    THROW_N_KEEPS,
+    TRANSITIONS,
+    aggregate_keeps,
+)
+
+
+def aggregate_outcomes(values, probs, aggregate="mean"):
+    """aggregate_keeps of a single keep, from the values of its outcomes"""
+    if aggregate == "mean":
+        # Rounded as aggregate_keeps, so that sparse and dense values tie alike
+        return np.round(probs @ values, 10)
+    quantile = 0.5 if aggregate == "median" else aggregate
+    order = np.argsort(values, kind="stable")
+    i_quantile = (probs[order].cumsum() < quantile - 1e-12).sum()
+    return values[order[i_quantile]]
+
+
+class TurnSearch:
+    """Expectimax over the two rerolls of a turn.
+    `aggregate` values the keeps of the second lock and `root_aggregate` those
+    of the first lock ("mean", "median" or a quantile, see aggregate_keeps).
+    """
+
+    def __init__(self, throw_scores, aggregate="mean", root_aggregate=None):
+        self.throw_scores = np.asarray(throw_scores, dtype=np.float64)
+        self.aggregate = aggregate
+        self.root_aggregate = aggregate if root_aggregate is None else root_aggregate
+        # Second lock keep values (chance nodes) and first reroll throw values
+        # (decision nodes), NaN until evaluated
+        self.keep_values = np.full(len(KEEPS), np.nan)
+        self.throw_values = np.full(len(self.throw_scores), np.nan)
+        # No throw can be worth more than the best leaf
+        self.upper_bound = self.throw_scores.max()
+        self.n_nodes = 0
+        self.n_pruned = 0
+
+    def depth1_values(self, keeps):
+        """Keep values when the dice are scored right after the reroll"""
+        return aggregate_keeps(self.throw_scores, keeps, self.root_aggregate)
+
+    def expand_keeps(self, keeps):
+        keeps = np.unique(keeps)
+        keeps = keeps[np.isnan(self.keep_values[keeps])]
+        if len(keeps):
+            self.keep_values[keeps] = aggregate_keeps(self.throw_scores, keeps, self.aggregate)
+            self.n_nodes += len(keeps)
+
+    def expand_throws(self, throws):
+        throws = throws[np.isnan(self.throw_values[throws])]
+        if len(throws):
+            self.expand_keeps(THROW_KEEPS[throws].ravel())
+            # Padded THROW_KEEPS columns repeat a keep, which leaves the max unchanged
+            self.throw_values[throws] = self.keep_values[THROW_KEEPS[throws]].max(axis=1)
+            self.n_nodes += len(throws)
+
+    def lock_values(self, throw_idx, max_keeps=None, max_nodes=None, time_limit=None):
+        """Values of the first lock keeps of a throw (THROW_KEEPS order).
+        Keeps are searched from the best depth 1 value down, at most
+        `max_keeps` of them. A keep whose upper bound (unexpanded throws
+        valued at the best leaf) cannot beat the best value found so far is
+        pruned and gets that bound. Once `max_nodes` new nodes are expanded or
+        `time_limit` seconds elapsed, the keeps left keep their depth 1 value.
+        """
+        keeps = THROW_KEEPS[throw_idx, :THROW_N_KEEPS[throw_idx]]
+        values = self.depth1_values(keeps)
+        start_nodes, deadline = self.n_nodes, None
+        if time_limit is not None:
+            deadline = perf_counter() + time_limit
+
+        best_value = -np.inf
+        for i in np.argsort(-values, kind="stable")[:max_keeps]:
+            if max_nodes is not None and self.n_nodes - start_nodes >= max_nodes:
+                break
+            if deadline is not None and perf_counter() > deadline:
+                break
+            start, end = KEEP_PTR[keeps[i]], KEEP_PTR[keeps[i] + 1]
+            throws, probs = KEEP_OUTCOMES[start:end], KEEP_PROBS[start:end]
+            throw_values = self.throw_values[throws]
+            is_unknown = np.isnan(throw_values)
+            if is_unknown.any():
+                throw_values[is_unknown] = self.upper_bound
+                bound = aggregate_outcomes(throw_values, probs, self.root_aggregate)
+                if bound < best_value:
+                    values[i] = bound
+                    self.n_pruned += 1
+                    continue
+                self.expand_throws(throws[is_unknown])
+                throw_values = self.throw_values[throws]
+            values[i] = aggregate_outcomes(throw_values, probs, self.root_aggregate)
+            best_value = max(best_value, values[i])
+        return values
+
+    def root_values(self, keeps=slice(None)):
+        """Values of first lock keeps (all of them by default), without
+        pruning. The throws they reach get expanded, which batched decisions
+        amortize over all the throws of the scoring state."""
+        keeps = np.arange(len(KEEPS))[keeps]
+        self.expand_throws(np.flatnonzero(TRANSITIONS[keeps].any(axis=0)))
+        # Throws left unexpanded are unreachable from these keeps
+        return aggregate_keeps(np.nan_to_num(self.throw_values), keeps, self.root_aggregate)
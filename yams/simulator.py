@@ -0,0 +1,71 @@
+"""Batch game simulator.
+Plays many games in lockstep with NumPy: sheets are held in a 2-D array,
+dice are rolled for all games at once and agents decide through their
+batched API (lock_dice_many / choose_row_many).
+"""
+import numpy as np
+from dice_tables import (
+    COUNTS_BASE,
+    COUNTS_THROW,
+    EMPTY_KEEP,
+    KEEP_COUNTS,
+    KEEP_N_REROLLS,
+)
+from profiling import timed_call
+from yams import POINTS_TABLE, ROWS_MASK, SHEET_KEYS, default_rng, fill_rows
+
+BONUS_COLUMN = SHEET_KEYS.index("Bonus")
+
+
+def reroll(keeps, rng):
+    """Throw indices after rerolling the dice not kept (KEEPS indices)"""
+    counts = KEEP_COUNTS[keeps]
+    dice = rng.integers(0, 6, (len(keeps), 5))
+    is_rerolled = np.arange(5) < KEEP_N_REROLLS[keeps][:, None]
+    counts = counts + ((dice[..., None] == np.arange(6)) & is_rerolled[..., None]).sum(axis=1)
+    return COUNTS_THROW[counts @ COUNTS_BASE]
+
+
+def play_rounds(agent, sheets, states, rng):
+    """Plays one round of every game (rows of the arrays), in place"""
+    games = np.arange(len(states))
+    options = {"rng": rng} if agent.uses_game_rng else {}
+    throws = reroll(np.full(len(states), EMPTY_KEEP), rng)
+    keeps = timed_call(
+        agent, "lock_dice_many", agent.lock_dice_many, states, throws,
+        is_first_lock=True, **options
+    )
+    throws = reroll(keeps, rng)
+    keeps = timed_call(
+        agent, "lock_dice_many", agent.lock_dice_many, states, throws,
+        is_first_lock=False, **options
+    )
+    throws = reroll(keeps, rng)
+    rows = timed_call(agent, "choose_row_many", agent.choose_row_many, states, throws)
+
+    points = POINTS_TABLE[throws, rows]
+    # Rows are filled once, and the Bonus row (scoring 0) keeps the bonus already won
+    sheets[games, rows] += points
+    states[:], bonus = fill_rows(states, rows, points)
+    sheets[:, BONUS_COLUMN] += bonus
+
+
+def play_games(agent, n_games, seed=None, batch_size=100_000):
+    """Final sheets (n_games, 14) of n_games games, columns in SHEET_KEYS order.
+    `seed` (int, SeedSequence or Generator) makes the games reproducible.
+    """
+    rng = default_rng() if seed is None else np.random.default_rng(seed)
+    all_sheets = []
+    for batch_start in range(0, n_games, batch_size):
+        n_batch = min(batch_size, n_games - batch_start)
+        sheets = np.zeros((n_batch, len(SHEET_KEYS)), dtype=np.int64)
+        states = np.zeros(n_batch, dtype=np.int64)
+        # Games can last more than 13 rounds if the agent picks the Bonus row
+        playing = np.arange(n_batch)
+        while len(playing):
+            sub_sheets, sub_states = sheets[playing], states[playing]
+            play_rounds(agent, sub_sheets, sub_states, rng)
+            sheets[playing], states[playing] = sub_sheets, sub_states
+            playing = playing[states[playing] & ROWS_MASK != ROWS_MASK]
+        all_sheets.append(sheets)
+    return np.concatenate(all_sheets)
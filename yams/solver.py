@@ -0,0 +1,119 @@
+"""Exact optimal strategy for a solo Yams game.
+Retrograde dynamic programming over all compact sheet states
+(filled rows, upper balance): the value of a state is the expected number
+of points still to score from it when playing optimally, lock decisions and
+row choice included.
+"""
+import os
+
+import numpy as np
+from dice_tables import EMPTY_KEEP, KEEPS, THROW_KEEPS, TRANSITIONS
+from yams import (
+    BALANCE_SHIFT,
+    BONUS_BIT,
+    BONUS_POINTS,
+    BONUS_THRESHOLD,
+    POINTS_TABLE,
+    SHEET_KEYS,
+    THROWS,
+    UPPER_KEYS,
+)
+
+PLAYABLE_ROWS = [k for k in SHEET_KEYS if k != "Bonus"]
+N_MASKS = 1 << len(PLAYABLE_ROWS)
+N_BALANCES = BONUS_THRESHOLD + 1
+FIRST_THROW = TRANSITIONS[EMPTY_KEEP]
+
+# Next to this module, wherever the scripts are run from
+VALUES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "optimal_values.npy")
+
+# Sheet column of each playable row, and playable index of upper rows
+ROW_COLUMNS = [SHEET_KEYS.index(k) for k in PLAYABLE_ROWS]
+UPPER_ROWS = [PLAYABLE_ROWS.index(i) for i in UPPER_KEYS]
+
+
+def playable_mask(state):
+    """Filled playable rows bitmask of a compact state (Bonus bit dropped)"""
+    below = state & (BONUS_BIT - 1)
+    above = ((state & ((1 << BALANCE_SHIFT) - 1)) >> 1) & ~(BONUS_BIT - 1)
+    return below | above
+
+
+def _final_throw_values(values, mask, balances):
+    """Best (points + value of next state) for each final throw and balance.
+    Returns the values (252, n_balances) and the chosen playable rows.
+    """
+    balances = np.asarray(balances)
+    row_values = np.full((len(PLAYABLE_ROWS), len(THROWS), len(balances)), -np.inf)
+    for i_row, column in enumerate(ROW_COLUMNS):
+        if mask & (1 << i_row):
+            continue
+        next_values = values[mask | (1 << i_row)]
+        points = POINTS_TABLE[:, column]
+        if i_row in UPPER_ROWS:
+            new_balances = balances[None, :] + points[:, None]
+            bonus = (balances[None, :] < BONUS_THRESHOLD) & (new_balances >= BONUS_THRESHOLD)
+            row_values[i_row] = (
+                points[:, None]
+                + BONUS_POINTS * bonus
+                + next_values[np.minimum(new_balances, BONUS_THRESHOLD)]
+            )
+        else:
+            row_values[i_row] = points[:, None] + next_values[balances][None, :]
+    return row_values.max(axis=0), row_values.argmax(axis=0)
+
+
+def _best_keep_values(keep_values):
+    """Best keep value for each throw, given the values of every keep"""
+    return keep_values[THROW_KEEPS].max(axis=1)
+
+
+def solve(verbose=False):
+    """State values of every (playable mask, upper balance), as a float32 array"""
+    values = np.zeros((N_MASKS, N_BALANCES))
+    balances = np.arange(N_BALANCES)
+    # Filling a row only sets bits, so successors always have a greater mask
+    for mask in range(N_MASKS - 2, -1, -1):
+        final_values, _ = _final_throw_values(values, mask, balances)
+        second_values = _best_keep_values(TRANSITIONS @ final_values)
+        first_values = _best_keep_values(TRANSITIONS @ second_values)
+        values[mask] = FIRST_THROW @ first_values
+        if verbose and mask % 512 == 0:
+            print(f"Solved masks >= {mask}, best expected score {values[mask].max():.2f}")
+    return values.astype(np.float32)
+
+
+def write_values(values_file, values):
+    # Written aside then renamed, so readers never see a partial file
+    with open(values_file + ".tmp", "wb") as file:
+        np.save(file, values)
+    os.replace(values_file + ".tmp", values_file)
+
+
+def load_values(values_file=None, verbose=False):
+    """Memory-mapped state values (of VALUES_FILE by default), solved and
+    written once if the file is missing"""
+    values_file = VALUES_FILE if values_file is None else values_file
+    if not os.path.exists(values_file):
+        write_values(values_file, solve(verbose=verbose))
+    return np.load(values_file, mmap_mode="r")
+
+
+class TurnPolicy:
+    """Optimal decisions of a whole turn from one compact state"""
+
+    def __init__(self, values, state):
+        mask = playable_mask(state)
+        balance = state >> BALANCE_SHIFT
+        final_values, final_rows = _final_throw_values(values, mask, [balance])
+        self.final_rows = final_rows[:, 0]
+        self.second_keep_values = TRANSITIONS @ final_values[:, 0]
+        self.first_keep_values = TRANSITIONS @ _best_keep_values(self.second_keep_values)
+
+    def lock(self, throw_idx, is_first_lock=True):
+        keep_values = self.first_keep_values if is_first_lock else self.second_keep_values
+        keeps = THROW_KEEPS[throw_idx]
+        return KEEPS[keeps[np.argmax(keep_values[keeps])]]
+
+    def row(self, throw_idx):
+        return PLAYABLE_ROWS[self.final_rows[throw_idx]]
@@ -0,0 +1,16 @@
+import numpy as np
+from agents import YamsRandom
+from yams import CommonDice, game_seeds, play_game
+
+
+def test_common_dice_leave_the_seed_unchanged():
+    seed = game_seeds(1, 0)[0]
+    scores = [play_game(YamsRandom(), seed=CommonDice(seed)) for _ in range(3)]
+    assert scores[0] == scores[1] == scores[2]
+    assert seed.n_children_spawned == 0
+
+
+def test_common_dice_decisions_are_not_the_dice():
+    dice = CommonDice(0)
+    decisions = dice.decisions.integers(1, 7, dice.dice.shape)
+    assert not np.array_equal(decisions, np.random.default_rng(0).integers(1, 7, dice.dice.shape))
@@ -0,0 +1,153 @@
+"""Multi-player tournaments.
+A match seats n_players agents, each filling its own sheet with its own dice;
+the highest score wins (tied players share the win). Every combination of
+agents plays its matches by chunks, each chunk seeded from the tournament
+seed, its combination and its index, so results do not depend on the
+scheduling. Chunks are played in the GameRunner workers with the batch
+simulator, and standings (win rates, pairwise results and Elo-scale ratings)
+are updated as chunks complete.
+"""
+import json
+from itertools import combinations
+
+import numpy as np
+from runner import GameRunner
+from simulator import play_games
+
+ELO_SCALE = 400 / np.log(10)
+BASE_RATING = 1500
+
+
+def play_scores(agent, n_games, seed):
+    """Final scores of n_games games of the agent (batch simulator)"""
+    return play_games(agent, n_games, seed=seed).sum(axis=1).astype(np.int16)
+
+
+def match_seed(seed, i_combination, i_chunk, i_seat):
+    return np.random.SeedSequence(seed, spawn_key=(i_combination, i_chunk, i_seat))
+
+
+class Standings:
+    """Results of a tournament so far: matches played by each agent, wins
+    and pairwise results.
+    pair_wins[i, j] counts the matches where agent i scored more than agent j
+    (half a win each on ties).
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        n_agents = len(self.names)
+        self.n_matches = 0
+        self.matches = np.zeros(n_agents, dtype=np.int64)
+        self.wins = np.zeros(n_agents)
+        self.score_sums = np.zeros(n_agents)
+        self.pair_wins = np.zeros((n_agents, n_agents))
+
+    def update(self, seats, scores):
+        """Adds the (n_matches, n_players) scores of matches between the seated agents"""
+        seats = list(seats)
+        scores = np.asarray(scores)
+        is_winner = scores == scores.max(axis=1, keepdims=True)
+        self.wins[seats] += (is_winner / is_winner.sum(axis=1, keepdims=True)).sum(axis=0)
+        self.n_matches += len(scores)
+        self.matches[seats] += len(scores)
+        self.score_sums[seats] += scores.sum(axis=0)
+        for i, j in combinations(range(len(seats)), 2):
+            ties = 0.5 * (scores[:, i] == scores[:, j]).sum()
+            self.pair_wins[seats[i], seats[j]] += (scores[:, i] > scores[:, j]).sum() + ties
+            self.pair_wins[seats[j], seats[i]] += (scores[:, j] > scores[:, i]).sum() + ties
+        return self
+
+    def win_rates(self):
+        return self.wins / np.maximum(self.matches, 1)
+
+    def mean_scores(self):
+        return self.score_sums / np.maximum(self.matches, 1)
+
+    def ratings(self, n_iterations=200, tolerance=1e-9):
+        """Elo-scale ratings (mean BASE_RATING) of the Bradley-Terry model fitted
+        to the pairwise results. Each pair that met counts one extra draw, so
+        an agent that never won still gets a finite rating."""
+        n_played = self.pair_wins + self.pair_wins.T
+        has_met = n_played > 0
+        pair_wins = self.pair_wins + 0.5 * has_met
+        n_played = n_played + has_met
+        wins = pair_wins.sum(axis=1)
+        strengths = np.ones(len(self.names))
+        for _ in range(n_iterations):
+            # Minorization-maximization update (Hunter, 2004)
+            denominators = (n_played / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+            new_strengths = np.where(wins > 0, wins / np.maximum(denominators, 1e-300), 1.0)
+            new_strengths /= np.exp(np.log(new_strengths).mean())
+            is_converged = np.abs(new_strengths - strengths).max() < tolerance
+            strengths = new_strengths
+            if is_converged:
+                break
+        return BASE_RATING + ELO_SCALE * np.log(strengths)
+
+    def summary(self):
+        ratings, win_rates, mean_scores = self.ratings(), self.win_rates(), self.mean_scores()
+        order = np.argsort(-ratings, kind="stable")
+        return {
+            "n_matches": self.n_matches,
+            "ranking": [
+                {
+                    "agent": self.names[i],
+                    "rating": float(ratings[i]),
+                    "win_rate": float(win_rates[i]),
+                    "mean_score": float(mean_scores[i]),
+                    "matches": int(self.matches[i]),
+                }
+                for i in order
+            ],
+        }
+
+
+def run_tournament(
+    agents, n_players=2, n_matches=1000, seed=0, chunk_size=1000, processes=None
+):
+    """Plays n_matches matches of every combination of n_players agents,
+    yielding the Standings after each chunk of matches.
+    Chunks of all combinations are interleaved, so the standings cover every
+    pairing early on.
+    """
+    standings = Standings(str(agent) for agent in agents)
+    seatings = list(combinations(range(len(agents)), n_players))
+    chunks = [
+        (i_combination, i_chunk, min(chunk_size, n_matches - start))
+        for (i_chunk, start) in enumerate(range(0, n_matches, chunk_size))
+        for i_combination in range(len(seatings))
+    ]
+    # One task per seat: the players of a match play in different workers
+    tasks = [
+        (agents[i_agent], n_chunk, match_seed(seed, i_combination, i_chunk, i_seat))
+        for (i_combination, i_chunk, n_chunk) in chunks
+        for (i_seat, i_agent) in enumerate(seatings[i_combination])
+    ]
+    with GameRunner(agents, processes) as runner:
+        # Ordered results: the seats of a chunk follow each other
+        results = runner.imap(play_scores, *zip(*tasks))
+        for i_combination, _, _ in chunks:
+            seats = seatings[i_combination]
+            scores = np.stack([next(results) for _ in seats], axis=1)
+            yield standings.update(seats, scores)
+
+
+if __name__ == "__main__":
+    from agents import YamsOptimal, YamsRandom, YamsT1, YamsT1E, YamsT1T, YamsT2, YamsT2KE
+
+    tournament_agents = [
+        YamsRandom(),
+        YamsT1(),
+        YamsT1E(),
+        YamsT1T(),
+        YamsT2(),
+        YamsT2KE(topk=3),
+        YamsOptimal(),
+    ]
+    for n_players in (2, 3):
+        print(f"{n_players} players")
+        for i, standings in enumerate(run_tournament(tournament_agents, n_players, 10_000)):
+            if i % 50 == 0:
+                print(json.dumps(standings.summary()["ranking"][:3]))
+        print(json.dumps(standings.summary(), indent=2))
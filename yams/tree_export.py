@@ -0,0 +1,96 @@
+"""Decision tree export.
+The tree of a turn alternates throw nodes (the agent locks dice) and lock
+nodes (the dice not kept are rerolled). It is walked lazily, depth first,
+from the agent's own cached lock and throw scores, keeping only the topk
+locks of each throw and the throws reached with at least min_prob, and
+streamed as fixed-size records to a binary file (see TREE_DTYPE): a node's
+id is its record index, and its edge is given by its parent id.
+"""
+from itertools import count, islice
+
+import numpy as np
+from dice_tables import KEEP_INDEX, KEEPS, keep_transitions
+from yams import SHEET_KEYS, THROWS, as_state, throw_index
+
+NODE_THROW = 0
+NODE_LOCK = 1
+TREE_DTYPE = np.dtype([
+    ("parent", np.int32),  # -1 for the root
+    ("kind", np.int8),  # NODE_THROW or NODE_LOCK
+    ("dice", np.int16),  # THROWS index of throw nodes, KEEPS index of lock nodes
+    ("row", np.int8),  # SHEET_KEYS index chosen for final throws, else -1
+    ("is_chosen", np.bool_),  # Lock chosen by the agent
+    ("prob", np.float32),  # Probability of reaching the node, given the locks above it
+    ("value", np.float32),  # Agent's score of the node
+])
+
+
+def walk_tree(agent, sheet, throw, is_first_lock=True, depth=None, topk=None, min_prob=0.0):
+    """Nodes of the agent's decision tree, as TREE_DTYPE tuples, depth first.
+    The root throw is locked for the first time if is_first_lock. The walk
+    goes down `depth` rerolls (by default to the final throws, which are
+    valued by their chosen row) and can be stopped at any time.
+    """
+    state = as_state(sheet)
+    _, throw_scores = agent.get_throw_table(state)
+    n_rerolls = 2 if is_first_lock else 1
+    depth = n_rerolls if depth is None else min(depth, n_rerolls)
+    ids = count()
+
+    def throw_nodes(parent, throw_idx, prob, rerolls_left, depth_left):
+        node_id = next(ids)
+        if rerolls_left == 0:
+            row = SHEET_KEYS.index(agent.choose_row(state, throw_idx))
+            yield (parent, NODE_THROW, throw_idx, row, False, prob, throw_scores[throw_idx])
+            return
+
+        is_first = rerolls_left == 2
+        lock_scores = agent.lock_scores(state, throw_idx, is_first)
+        yield (parent, NODE_THROW, throw_idx, -1, False, prob, max(lock_scores.values()))
+        if depth_left == 0:
+            return
+        chosen = tuple(sorted(agent.lock_dice(state, throw_idx, is_first_lock=is_first)))
+        # Best locks first (ties in lock_scores order), the chosen one leading
+        locks = sorted(lock_scores, key=lambda lock: (lock != chosen, -lock_scores[lock]))
+        for lock in locks[:topk]:
+            yield from lock_nodes(node_id, lock, lock_scores[lock], lock == chosen,
+                                  prob, rerolls_left, depth_left)
+
+    def lock_nodes(parent, lock, value, is_chosen, prob, rerolls_left, depth_left):
+        node_id = next(ids)
+        yield (parent, NODE_LOCK, KEEP_INDEX[lock], -1, is_chosen, prob, value)
+        outcomes, outcome_probs = keep_transitions(lock)
+        for throw_idx, outcome_prob in zip(outcomes.tolist(), outcome_probs.tolist()):
+            if prob * outcome_prob >= min_prob:
+                yield from throw_nodes(node_id, throw_idx, prob * outcome_prob,
+                                       rerolls_left - 1, depth_left - 1)
+
+    return throw_nodes(-1, throw_index(throw), 1.0, n_rerolls, depth)
+
+
+def export_tree(agent, sheet, throw, tree_file, max_nodes=None, buffer_size=1 << 12, **options):
+    """Streams walk_tree (options as its arguments) to tree_file, at most
+    max_nodes nodes, holding buffer_size nodes in memory. Returns the number
+    of nodes written."""
+    nodes = islice(walk_tree(agent, sheet, throw, **options), max_nodes)
+    n_nodes = 0
+    with open(tree_file, "wb") as file:
+        while buffer := list(islice(nodes, buffer_size)):
+            file.write(np.array(buffer, dtype=TREE_DTYPE).tobytes())
+            n_nodes += len(buffer)
+    return n_nodes
+
+
+def read_tree(tree_file):
+    """Nodes of a tree file, memory-mapped"""
+    return np.memmap(tree_file, dtype=TREE_DTYPE, mode="r")
+
+
+def node_label(node):
+    """Dice of a node, with its chosen row for final throws"""
+    if node["kind"] == NODE_LOCK:
+        return str(KEEPS[node["dice"]])
+    label = str(THROWS[node["dice"]])
+    if node["row"] >= 0:
+        label += f" -> {SHEET_KEYS[node['row']]}"
+    return label
@@ -0,0 +1,134 @@
+"""Parameter fitting by simulation.
+Candidates are compared with successive halving on common random numbers:
+every candidate plays the same pre-drawn dice (yams.CommonDice), the best 1/eta of them play eta
+times more games, down to the best of the last round. YamsT1T target scores are fitted from
+random perturbations of a starting target, written as a target file.
+"""
+import json
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from agents import YamsT1E, YamsT1T
+from runner import GameRunner
+from yams import SHEET_KEYS
+
+
+def targets_from_sheets(sheets, quantile=0.5):
+    """Mean points of each row over the games scoring above the score quantile,
+    weighted by their score (sheets as a (n, 14) array in SHEET_KEYS order)"""
+    sheets = np.asarray(sheets, dtype=np.float64)
+    scores = sheets.sum(axis=1)
+    is_good = scores > np.quantile(scores, quantile)
+    targets = scores[is_good] @ sheets[is_good] / scores[is_good].sum()
+    return dict(zip(SHEET_KEYS, targets.tolist()))
+
+
+def read_targets(target_file):
+    with open(target_file, encoding="utf-8") as file:
+        targets = json.load(file)
+    return {k: targets[str(k)] for k in SHEET_KEYS}
+
+
+def write_targets(target_file, targets):
+    with open(target_file, "w", encoding="utf-8") as file:
+        json.dump({str(k): targets[k] for k in SHEET_KEYS}, file, indent=4)
+
+
+def perturb_targets(targets, scale, rng):
+    """Targets multiplied by independent log-normal factors"""
+    factors = np.exp(scale * rng.standard_normal(len(SHEET_KEYS)))
+    return {k: targets[k] * factor for (k, factor) in zip(SHEET_KEYS, factors.tolist())}
+
+
+def successive_halving(
+    agents, n_games=200, eta=3, max_games=20000, seed=0, processes=None, verbose=True
+):
+    """Index of the best agent (highest mean score) and the mean scores of the
+    last round. All agents play on the same dice (common random numbers)."""
+    candidates = list(range(len(agents)))
+    while True:
+        with GameRunner([agents[i] for i in candidates], processes) as runner:
+            sheets = runner.play(n_games, seed, common_dice=True)
+        mean_scores = [
+            float(agent_sheets.sum(axis=1, dtype=np.int64).mean()) for agent_sheets in sheets
+        ]
+        order = np.argsort(mean_scores, kind="stable")[::-1]
+        if verbose:
+            print(
+                f"{len(candidates)} candidates, {n_games} games: best {mean_scores[order[0]]:.2f}, "
+                f"median {np.median(mean_scores):.2f}"
+            )
+        if len(candidates) <= eta or n_games * eta > max_games:
+            return candidates[order[0]], {candidates[i]: mean_scores[i] for i in order}
+        candidates = [candidates[i] for i in order[:max(1, len(candidates) // eta)]]
+        n_games *= eta
+
+
+def fit_targets(
+    initial_targets,
+    target_file="target_fitted_YamsT1T.json",
+    n_candidates=27,
+    scale=0.2,
+    n_games=200,
+    eta=3,
+    max_games=20000,
+    seed=0,
+    processes=None,
+    verbose=True,
+):
+    """Fits YamsT1T target scores around initial_targets (which stay a
+    candidate) and writes the best ones to target_file"""
+    rng = np.random.default_rng(seed)
+    candidates = [initial_targets] + [
+        perturb_targets(initial_targets, scale, rng) for _ in range(n_candidates - 1)
+    ]
+    with TemporaryDirectory() as candidates_dir:
+        agents = []
+        for i, targets in enumerate(candidates):
+            candidate_file = os.path.join(candidates_dir, f"target_candidate_{i}.json")
+            write_targets(candidate_file, targets)
+            agents.append(YamsT1T(target_scores_file=candidate_file))
+        i_best, mean_scores = successive_halving(
+            agents, n_games, eta, max_games, seed, processes, verbose
+        )
+    write_targets(target_file, candidates[i_best])
+    if verbose:
+        print(f"Candidate {i_best} written to {target_file} (initial targets are candidate 0)")
+    return candidates[i_best], mean_scores
+
+
+def fit_points_power(
+    powers=(1.0, 1.25, 1.5, 1.75, 2.0, 2.5),
+    n_games=500,
+    eta=2,
+    max_games=20000,
+    seed=0,
+    processes=None,
+    verbose=True,
+):
+    """Best YamsT1E points_power. (YamsT1T row scores do not depend on it.)"""
+    agents = [YamsT1E(points_power=power) for power in powers]
+    i_best, mean_scores = successive_halving(
+        agents, n_games, eta, max_games, seed, processes, verbose
+    )
+    return powers[i_best], {powers[i]: score for (i, score) in mean_scores.items()}
+
+
+if __name__ == "__main__":
+    from results import SHEET_COLUMNS, ResultStore
+
+    # Starting targets: from stored YamsT1E sheets if any, else the current file
+    records = ResultStore("data/results.bin").read()
+    records = records[records["agent"] == b"YamsT1E"]
+    if len(records):
+        initial_targets = targets_from_sheets(
+            np.stack([records[column] for column in SHEET_COLUMNS], axis=1)
+        )
+    else:
+        initial_targets = read_targets("target_median_YamsT1E.json")
+
+    power, power_scores = fit_points_power()
+    print("YamsT1E points_power:", power, power_scores)
+    targets, _ = fit_targets(initial_targets)
+    print(json.dumps({str(k): v for (k, v) in targets.items()}, indent=4))
@@ -1,8 +1,68 @@
+import os
 from collections import Counter
+from itertools import combinations_with_replacement
+from time import perf_counter
 from typing import List
 import numpy as np
+from profiling import instrumented, is_enabled, record, timed_call
 
-def roll_dice(n=5, real_dice=False):
+_rng = np.random.default_rng()
+
+
+def default_rng():
+    """Generator used when none is given, reseeded in forked processes"""
+    return _rng
+
+
+def _reseed_after_fork():
+    # Forked workers (p_map) would otherwise replay the parent dice sequences
+    global _rng
+    _rng = np.random.default_rng()
+    np.random.seed()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed_after_fork)
+
+
+class CommonDice:
+    """Dice of a game drawn in advance, to play several agents on the same dice.
+    The k-th roll of the game (3 per round) takes its n dice from a fixed row
+    of 5 pre-drawn dice, so agents locking differently still share most dice.
+    Usable as the `rng` of roll_dice/play_round or the `seed` of play_game.
+    """
+
+    def __init__(self, seed=None, n_rounds=16):
+        self.rng = np.random.default_rng(seed)
+        # Random decisions get their own stream, so they don't shift the dice.
+        # It is the seed's first child, built without spawning from the seed:
+        # spawn would change it, and the next CommonDice of that seed with it
+        seed_seq = self.rng.bit_generator.seed_seq
+        self.decisions = np.random.default_rng(np.random.SeedSequence(
+            seed_seq.entropy, spawn_key=(*seed_seq.spawn_key, 0), pool_size=seed_seq.pool_size
+        ))
+        self.dice = self.rng.integers(1, 7, (3 * n_rounds, 5))
+        self.i_roll = 0
+
+    def integers(self, low, high, size):
+        if self.i_roll == len(self.dice):
+            self.dice = np.concatenate((self.dice, self.rng.integers(1, 7, self.dice.shape)))
+        dice = self.dice[self.i_roll, :size]
+        self.i_roll += 1
+        return dice
+
+
+def decision_rng(rng):
+    """Generator of the random decisions of a game rolling its dice with rng"""
+    return rng.decisions if isinstance(rng, CommonDice) else rng
+
+
+def game_seeds(n_games, seed=None):
+    """Independent seeds of n_games games, reproducible from a single seed"""
+    return np.random.SeedSequence(seed).spawn(n_games)
+
+
+def roll_dice(n=5, real_dice=False, rng=None):
     if real_dice:
         try:
             table_dice = input("Thrown dices:")
@@ -21,7 +81,9 @@ def roll_dice(n=5, real_dice=False):
         finally:
             return dices
     else:
-        return tuple(sorted(np.random.randint(1, 7, n)))
+        if rng is None:
+            rng = default_rng()
+        return tuple(sorted(rng.integers(1, 7, n).tolist()))
 
 
 PETITE_SUITES: List[set] = [{1, 2, 3, 4}, {2, 3, 4, 5}, {3, 4, 5, 6}]
@@ -82,80 +144,221 @@ def check_grande_suite(throw):
     return False
 
 
-def get_sheet_points(sheet: dict, throw: tuple, real=False):
-    sheet_row_used = {k: 0 for k in SHEET_KEYS}
+def _throw_points(throw):
+    """Raw points of a throw in every row, as if the whole sheet was empty"""
+    points = {k: 0 for k in SHEET_KEYS}
     # [1::6] columns
     for i in range(1, 7):
-        if sheet[i] is None:
-            eval = i * throw.count(i)
-            sheet_row_used[i] = int(eval)
-            # Bonus
-            if real or sheet['Bonus']:
-                continue
-            curr_balance = (
-                sum(map(lambda x: x if x else 0, [sheet[i] for i in range(1, 7)]))
-                + eval
-            )
-            if curr_balance >= 63:
-                sheet_row_used[i] += 35
+        points[i] = i * throw.count(i)
 
     # Chance
-    if not sheet["Chance"]:
-        eval = sum(throw)
-        sheet_row_used["Chance"] = int(eval)
+    points["Chance"] = sum(throw)
 
-    # Full
     occ_counter = Counter(throw)
     i_max, i_occ = occ_counter.most_common(1)[0]
-    if not sheet["Full"] and len(occ_counter) == 2 and i_occ == 3:
-        sheet_row_used["Full"] = 25
-
+    # Full
+    if len(occ_counter) == 2 and i_occ == 3:
+        points["Full"] = 25
     # Brelan
-    if not sheet["Brelan"] and i_occ >= 3:
-        eval = 3 * i_max
-        sheet_row_used["Brelan"] = int(eval)
-
+    if i_occ >= 3:
+        points["Brelan"] = 3 * i_max
     # Carré
-    if not sheet["Carré"] and i_occ >= 4:
-        eval = 4 * i_max
-        sheet_row_used["Carré"] = int(eval)
-
+    if i_occ >= 4:
+        points["Carré"] = 4 * i_max
     # P. Suite
-    if not sheet["Petite Suite"] and check_petite_suite(throw):
-        sheet_row_used["Petite Suite"] = 30
+    if check_petite_suite(throw):
+        points["Petite Suite"] = 30
     # G. Suite
-    if not sheet["Grande Suite"] and check_grande_suite(throw):
-        sheet_row_used["Grande Suite"] = 40
+    if check_grande_suite(throw):
+        points["Grande Suite"] = 40
     # Yams
-    if not sheet["Yams"] and i_occ == 5:
-        sheet_row_used["Yams"] = 50
+    if i_occ == 5:
+        points["Yams"] = 50
+
+    return [points[k] for k in SHEET_KEYS]
+
+
+# All 252 sorted throws of 5 dice, and their index in the scoring table
+THROWS: List[tuple] = list(combinations_with_replacement(range(1, 7), 5))
+THROW_INDEX = {throw: i for i, throw in enumerate(THROWS)}
+# Points of each throw (rows) in each sheet row (columns, SHEET_KEYS order)
+POINTS_TABLE = np.array([_throw_points(throw) for throw in THROWS], dtype=np.int64)
+POINTS_TABLE.setflags(write=False)
+
+UPPER_KEYS = list(range(1, 7))
+BONUS_THRESHOLD = 63
+BONUS_POINTS = 35
+
+
+def sheet_upper_balance(sheet):
+    return sum(sheet[i] for i in UPPER_KEYS if sheet[i] is not None)
+
 
-    return sheet_row_used
+def get_points(open_rows, throw_idx=slice(None), upper_balance=0, bonus=True):
+    """Vectorized sheet points.
+    Points scored in each open row by the throw(s) at `throw_idx` (closed rows
+    score 0). With the default `throw_idx`, returns the whole (252, 14) table.
+    If `bonus`, upper rows reaching the bonus threshold also get the bonus points.
+    """
+    points = POINTS_TABLE[throw_idx] * open_rows
+    if bonus:
+        upper_points = points[..., :6]
+        upper_points += BONUS_POINTS * (
+            (upper_points + upper_balance >= BONUS_THRESHOLD) & open_rows[:6]
+        )
+    return points
 
-def play_round(sheet, agent, verbose=True, real_dice=False):
+
+# Compact sheet state: filled rows bitmask (SHEET_KEYS order) in the low bits,
+# upper section balance (capped at the bonus threshold) in the high bits
+ROW_BITS = {k: 1 << i for (i, k) in enumerate(SHEET_KEYS)}
+BONUS_BIT = ROW_BITS["Bonus"]
+UPPER_BITS = sum(ROW_BITS[i] for i in UPPER_KEYS)
+ROWS_MASK = (1 << len(SHEET_KEYS)) - 1
+BALANCE_SHIFT = len(SHEET_KEYS)
+EMPTY_STATE = 0
+# Open rows boolean mask of every filled rows bitmask
+OPEN_ROWS_TABLE = ((np.arange(ROWS_MASK + 1)[:, None] >> np.arange(len(SHEET_KEYS))) & 1) == 0
+OPEN_ROWS_TABLE.setflags(write=False)
+
+
+def make_state(filled_rows, upper_balance):
+    return filled_rows | (min(upper_balance, BONUS_THRESHOLD) << BALANCE_SHIFT)
+
+
+def encode_sheet(sheet: dict) -> int:
+    filled_rows = 0
+    for k, bit in ROW_BITS.items():
+        if sheet[k] is not None:
+            filled_rows |= bit
+    return make_state(filled_rows, sheet_upper_balance(sheet))
+
+
+def as_state(sheet) -> int:
+    """Compact state of a sheet dict, compact states are returned as is"""
+    if isinstance(sheet, dict):
+        return encode_sheet(sheet)
+    return int(sheet)
+
+
+def throw_index(throw) -> int:
+    if isinstance(throw, tuple):
+        return THROW_INDEX[throw]
+    return int(throw)
+
+
+def is_row_open(state, row):
+    return not state & ROW_BITS[row]
+
+
+# Highest open upper face of each upper rows bitmask (0 when all are filled)
+MAX_OPEN_FACE = np.array([
+    max([i for i in UPPER_KEYS if not upper_rows & ROW_BITS[i]], default=0)
+    for upper_rows in range(UPPER_BITS + 1)
+])
+
+
+def scoring_state(state):
+    """Smallest state scoring every throw like `state`.
+    The upper balance is dropped when it can't give the bonus this turn.
+    """
+    if state & BONUS_BIT or (
+        (state >> BALANCE_SHIFT) + 5 * MAX_OPEN_FACE[state & UPPER_BITS] < BONUS_THRESHOLD
+    ):
+        return state & ROWS_MASK
+    return state
+
+
+def scoring_states(states):
+    """scoring_state of an array of states"""
+    states = np.asarray(states, dtype=np.int64)
+    no_bonus = (states & BONUS_BIT).astype(bool) | (
+        (states >> BALANCE_SHIFT) + 5 * MAX_OPEN_FACE[states & UPPER_BITS] < BONUS_THRESHOLD
+    )
+    return np.where(no_bonus, states & ROWS_MASK, states)
+
+
+def states_points(states):
+    """state_points of an array of states, as a (n_states, 252, 14) array"""
+    states = np.asarray(states, dtype=np.int64)
+    open_rows = OPEN_ROWS_TABLE[states & ROWS_MASK][:, None, :]
+    points = POINTS_TABLE[None] * open_rows
+    upper_points = points[..., :6]
+    upper_points += BONUS_POINTS * (
+        (upper_points + (states >> BALANCE_SHIFT)[:, None, None] >= BONUS_THRESHOLD)
+        & open_rows[..., :6]
+        & ((states & BONUS_BIT) == 0)[:, None, None]
+    )
+    return points
+
+
+def state_points(state, throw_idx=slice(None), real=False):
+    """get_points for a compact state"""
+    return get_points(
+        OPEN_ROWS_TABLE[state & ROWS_MASK],
+        throw_idx,
+        state >> BALANCE_SHIFT,
+        bonus=not (real or state & BONUS_BIT),
+    )
+
+
+def fill_rows(states, rows, points):
+    """Next states and bonus points won after writing points in rows (SHEET_KEYS
+    indices) of an array of states, bonus updated like play_round.
+    The Bonus row itself scores 0, the bonus is won when the balance crosses the threshold.
+    """
+    upper_balances = states >> BALANCE_SHIFT
+    new_balances = upper_balances + np.where(rows < len(UPPER_KEYS), points, 0)
+    filled_rows = (states & ROWS_MASK) | (1 << rows)
+    is_bonus_finished = (new_balances >= BONUS_THRESHOLD) | (
+        filled_rows & UPPER_BITS == UPPER_BITS
+    )
+    filled_rows |= np.where(is_bonus_finished, BONUS_BIT, 0)
+    bonus = BONUS_POINTS * (
+        (upper_balances < BONUS_THRESHOLD) & (new_balances >= BONUS_THRESHOLD)
+    )
+    next_states = filled_rows | (np.minimum(new_balances, BONUS_THRESHOLD) << BALANCE_SHIFT)
+    return next_states, bonus
+
+
+@instrumented
+def get_sheet_points(sheet: dict, throw: tuple, real=False):
+    points = state_points(as_state(sheet), throw_index(throw), real=real)
+    return dict(zip(SHEET_KEYS, points.tolist()))
+
+def play_round(sheet, agent, verbose=True, real_dice=False, rng=None):
     # First throw, full random
-    first_throw = roll_dice(real_dice=real_dice)
+    first_throw = roll_dice(real_dice=real_dice, rng=rng)
     if verbose: print("First throw:", first_throw)
 
+    # Agents decide on the compact sheet state
+    state = encode_sheet(sheet)
+    # Random agents draw their locks from the game's generator, for reproducible games
+    options = {"rng": decision_rng(rng)} if agent.uses_game_rng and rng is not None else {}
+
     # Locking some dice a first time
-    locked_dice = agent.lock_dice(sheet, first_throw, is_first_lock=True)
+    locked_dice = timed_call(
+        agent, "lock_dice", agent.lock_dice, state, first_throw, is_first_lock=True, **options
+    )
     if verbose: print("Locked dice:", locked_dice)
 
     # Throwing some dice a second time
-    second_throw = roll_dice(5 - len(locked_dice), real_dice=real_dice)
+    second_throw = roll_dice(5 - len(locked_dice), real_dice=real_dice, rng=rng)
     if verbose: print("Second throw:", second_throw)
     second_throw = tuple(sorted((*locked_dice, *second_throw)))
 
     # Locking some dice a second time
-    locked_dice = agent.lock_dice(sheet, second_throw, is_first_lock=False)
+    locked_dice = timed_call(
+        agent, "lock_dice", agent.lock_dice, state, second_throw, is_first_lock=False, **options
+    )
     if verbose: print("Keeping dice:", locked_dice)
 
     # Throwing some more dice a third and final time
-    final_throw = roll_dice(5 - len(locked_dice), real_dice=real_dice)
+    final_throw = roll_dice(5 - len(locked_dice), real_dice=real_dice, rng=rng)
     if verbose: print("Third throw:", final_throw)
     final_throw = tuple(sorted((*locked_dice, *final_throw)))
 
-    row = agent.choose_row(sheet, final_throw)
+    row = timed_call(agent, "choose_row", agent.choose_row, state, final_throw)
     points = get_sheet_points(sheet, final_throw, real=True)
     sheet[row] = points[row]
     
@@ -176,10 +379,21 @@ def play_round(sheet, agent, verbose=True, real_dice=False):
         
     if verbose: print_pretty_sheet(sheet)
 
-def play_game(agent, verbose=False, return_sheet=False, real_dice=False):
+def play_game(agent, verbose=False, return_sheet=False, real_dice=False, seed=None):
+    """Plays a full game. `seed` (int, SeedSequence, Generator or CommonDice)
+    makes the dice reproducible, see game_seeds for many independent games."""
+    if seed is None:
+        rng = default_rng()
+    elif isinstance(seed, CommonDice):
+        rng = seed
+    else:
+        rng = np.random.default_rng(seed)
+    t0 = perf_counter()
     my_sheet = {k: None for k in SHEET_KEYS}
     while None in my_sheet.values():
-        play_round(my_sheet, agent, verbose=verbose, real_dice=real_dice)
+        play_round(my_sheet, agent, verbose=verbose, real_dice=real_dice, rng=rng)
+    if is_enabled():
+        record(f"{agent}.play_game", perf_counter() - t0)
     if return_sheet:
         return my_sheet
     else: